@@ -0,0 +1,76 @@
+"""
+qrztools: interning benchmark
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+
+Measures the memory used by parsed callsign records, with and without the interning done by the parser.
+Run with ``python benchmarks/bench_interning.py``.
+"""
+
+
+import gc
+import random
+import tracemalloc
+from typing import List
+
+from lxml import etree
+
+import qrztools.qrztools as qrztools
+from qrztools import QrzCallsignData, QrzSync
+
+
+RECORDS = 100000
+
+ENTITIES = [(291, "United States"), (1, "Canada"), (223, "England"), (230, "Germany"), (339, "Japan")]
+STATES = ["CT", "MA", "NY", "CA", "TX", "ON", "QC", ""]
+TIMEZONES = ["Eastern", "Central", "Mountain", "Pacific", ""]
+CLASSES = ["E", "G", "T", "A", "C", ""]
+
+TEMPLATE = ('<?xml version="1.0" ?><QRZDatabase version="1.34" xmlns="http://xmldata.qrz.com">'
+            "<Callsign><call>{call}</call><dxcc>{dxcc}</dxcc><land>{land}</land><country>{land}</country>"
+            "<state>{state}</state><class>{lic_class}</class><TimeZone>{timezone}</TimeZone><GMTOffset>-5</GMTOffset>"
+            "<geoloc>user</geoloc></Callsign><Session><Key>key</Key></Session></QRZDatabase>")
+
+
+def responses() -> List[etree._Element]:
+    rng = random.Random(42)
+    resps = []
+    for i in range(RECORDS):
+        dxcc, land = rng.choice(ENTITIES)
+        resps.append(etree.fromstring(TEMPLATE.format(
+            call=f"K{i}AB", dxcc=dxcc, land=land, state=rng.choice(STATES), lic_class=rng.choice(CLASSES),
+            timezone=rng.choice(TIMEZONES),
+        ).encode()))
+    return resps
+
+
+def measure(qrz: QrzSync, resps: List[etree._Element]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    records: List[QrzCallsignData] = [qrz._process_callsign(resp) for resp in resps]
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    return size
+
+
+if __name__ == "__main__":
+    qrz = QrzSync("user", "pass")
+    resps = responses()
+
+    interned = measure(qrz, resps)
+
+    shared_dxcc, intern = qrztools._shared_dxcc, qrztools._intern
+    qrztools._shared_dxcc, qrztools._intern = qrztools.Dxcc, lambda val: val  # type: ignore
+    try:
+        plain = measure(qrz, resps)
+    finally:
+        qrztools._shared_dxcc, qrztools._intern = shared_dxcc, intern
+
+    print(f"{RECORDS} records")
+    print(f"without interning   {plain / 2**20:8.1f} MiB")
+    print(f"with interning      {interned / 2**20:8.1f} MiB")
+    print(f"saved               {(plain - interned) / 2**20:8.1f} MiB ({(plain - interned) / plain:.0%}), "
+          f"{(plain - interned) / RECORDS:.0f} bytes per record")
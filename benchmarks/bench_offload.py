@@ -0,0 +1,66 @@
+"""
+qrztools: parse offloading benchmark
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+
+Measures how long the event loop is blocked while QrzAsync handles ``get_dxcc("all")`` replies, with parsing on
+the event loop and with it offloaded to a thread. The replies are served from a recording, so no network access is
+needed. Run with ``python benchmarks/bench_offload.py``.
+"""
+
+
+import asyncio
+import time
+from typing import List, Optional
+
+from qrztools import AsyncReplayTransport, OffloadConfig, QrzAsync, Recording, TransportResponse
+
+
+ENTITIES = 400
+QUERIES = 50
+
+HEAD = '<?xml version="1.0" ?><QRZDatabase version="1.34" xmlns="http://xmldata.qrz.com">'
+ENTITY = ("<DXCC><dxcc>{n}</dxcc><cc>XX</cc><ccc>XXX</ccc><name>Entity {n}</name><continent>EU</continent>"
+          "<ituzone>28</ituzone><cqzone>14</cqzone><timezone>100</timezone><lat>50.0</lat><lon>10.0</lon>"
+          "<notes>Notes about entity {n}</notes></DXCC>")
+
+
+async def run(offload: Optional[OffloadConfig]) -> None:
+    recording = Recording()
+    qrz = QrzAsync("user", "pass", session_key="key", transport=AsyncReplayTransport(recording), offload=offload)
+    body = (HEAD + "".join(ENTITY.format(n=n) for n in range(1, ENTITIES + 1))
+            + "<Session><Key>key</Key></Session></QRZDatabase>").encode()
+    recording.add(qrz._build_url({"s": "key", "dxcc": "all"}), TransportResponse(200, body, "utf-8"))
+
+    # a task that should wake up every millisecond, to measure how late the event loop lets it run
+    lags: List[float] = []
+    running = True
+
+    async def ticker() -> None:
+        while running:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - start - 0.001)
+
+    tick = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    for _ in range(QUERIES):
+        await qrz.get_dxcc("all")
+        # replayed replies are ready at once, so the loop is given a chance to run the ticker like network I/O would
+        await asyncio.sleep(0)
+    total = time.perf_counter() - start
+    running = False
+    await tick
+
+    stats = qrz.parse_stats
+    lags.sort()
+    print(f"{'offloaded' if offload else 'inline':10} {total / QUERIES * 1e3:5.1f} ms per query, "
+          f"event loop blocked {stats.blocked * 1e3:6.1f} ms in total and {stats.max_blocked * 1e3:5.1f} ms at most, "
+          f"ticker lag p50 {lags[len(lags) // 2] * 1e3:5.2f} ms, max {lags[-1] * 1e3:5.2f} ms")
+
+
+if __name__ == "__main__":
+    print(f"{QUERIES} queries, {ENTITIES} entities per reply")
+    asyncio.run(run(None))
+    asyncio.run(run(OffloadConfig()))
@@ -0,0 +1,55 @@
+"""
+qrztools: field projection benchmark
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+
+Measures the time to turn parsed callsign replies into results: full records, records with only a few fields
+decoded, and the raw tag mapping. Run with ``python benchmarks/bench_projection.py``.
+"""
+
+
+import timeit
+from typing import Callable, List
+
+from lxml import etree
+
+from qrztools import QrzSync
+from qrztools.qrztools import _callsign_fields
+
+
+RECORDS = 10000
+
+TEMPLATE = ('<?xml version="1.0" ?><QRZDatabase version="1.34" xmlns="http://xmldata.qrz.com">'
+            "<Callsign><call>K{n}AB</call><xref>K{n}AB</xref><aliases>K{n}AB/P</aliases><dxcc>291</dxcc>"
+            "<fname>Hiram</fname><name>Maxim</name><addr1>225 Main St</addr1><addr2>Newington</addr2>"
+            "<state>CT</state><zip>06111</zip><country>United States</country><ccode>291</ccode>"
+            "<lat>41.714775</lat><lon>-72.727260</lon><grid>FN31pr</grid><county>Hartford</county>"
+            "<land>United States</land><efdate>2000-01-20</efdate><expdate>2030-01-20</expdate><class>E</class>"
+            "<codes>HVIE</codes><email>k{n}ab@example.com</email><u_views>1234</u_views><bio>3937</bio>"
+            "<biodate>2020-03-19 22:14:45</biodate><image>https://example.com/k{n}ab.jpg</image>"
+            "<imageinfo>285:500:44350</imageinfo><moddate>2020-03-19 22:14:45</moddate><serial>42</serial>"
+            "<MSA>3280</MSA><AreaCode>860</AreaCode><TimeZone>Eastern</TimeZone><GMTOffset>-5</GMTOffset>"
+            "<DST>Y</DST><eqsl>0</eqsl><mqsl>1</mqsl><cqzone>5</cqzone><ituzone>8</ituzone><geoloc>user</geoloc>"
+            "<born>1900-01-01</born><lotw>1</lotw><user>K{n}AB</user></Callsign>"
+            "<Session><Key>key</Key></Session></QRZDatabase>")
+
+
+def run(process: Callable[[etree._Element], object], resps: List[etree._Element]) -> float:
+    # the best of a few runs, in microseconds per record
+    return min(timeit.repeat(lambda: [process(resp) for resp in resps], number=1, repeat=5)) / len(resps) * 1e6
+
+
+if __name__ == "__main__":
+    qrz = QrzSync("user", "pass")
+    resps = [etree.fromstring(TEMPLATE.format(n=n).encode()) for n in range(RECORDS)]
+    grid_dxcc = _callsign_fields(["grid", "dxcc"])
+
+    full = run(qrz._process_callsign, resps)
+    projected = run(lambda resp: qrz._process_callsign(resp, grid_dxcc), resps)
+    raw = run(qrz._process_callsign_raw, resps)
+
+    print(f"{RECORDS} records, microseconds per record")
+    print(f"all fields          {full:8.1f}")
+    print(f"grid and dxcc       {projected:8.1f} ({projected / full:.0%})")
+    print(f"raw                 {raw:8.1f} ({raw / full:.0%})")
@@ -0,0 +1,87 @@
+"""
+qrztools: replay benchmark
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+
+Measures the throughput and latency of QrzSync and QrzAsync callsign lookups offline, by replaying the lookups in a
+scrubbed recording with their recorded latencies. Record one by passing a Recording to a client and saving it, then
+run with ``python benchmarks/bench_replay.py recording.json.gz [latency factor] [concurrency]``.
+"""
+
+
+import asyncio
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from urllib.parse import unquote
+
+from qrztools import AsyncReplayTransport, QrzAsync, QrzError, QrzSync, Recording, ReplayTransport
+
+
+def callsigns(recording: Recording) -> List[str]:
+    calls = []
+    for url in recording.urls():
+        params = dict(param.partition("=")[::2] for param in url.partition("?")[2].split(";"))
+        if "callsign" in params:
+            calls.append(unquote(params["callsign"]))
+    return calls
+
+
+def report(name: str, total: float, latencies: List[float]) -> None:
+    latencies.sort()
+    p50, p99 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+    print(f"{name:6} {len(latencies) / total:8.1f} lookups/s, latency p50 {p50 * 1e3:7.1f} ms, p99 {p99 * 1e3:7.1f} ms")
+
+
+def lookup(qrz: QrzSync, call: str) -> float:
+    start = time.perf_counter()
+    try:
+        qrz.get_callsign(call)
+    except QrzError as e:
+        # not found replies are replayed too
+        if not str(e).startswith("Not found"):
+            raise
+    return time.perf_counter() - start
+
+
+def run_sync(recording: Recording, calls: List[str], factor: float, concurrency: int) -> None:
+    # the session key is scrubbed from the recording, so any key matches and no login is needed
+    qrz = QrzSync("user", "pass", session_key="replay", transport=ReplayTransport(recording, factor))
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(lambda call: lookup(qrz, call), calls))
+    report("sync", time.perf_counter() - start, latencies)
+
+
+async def run_async(recording: Recording, calls: List[str], factor: float, concurrency: int) -> None:
+    qrz = QrzAsync("user", "pass", session_key="replay", transport=AsyncReplayTransport(recording, factor))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def lookup(call: str) -> float:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await qrz.get_callsign(call)
+            except QrzError as e:
+                if not str(e).startswith("Not found"):
+                    raise
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = list(await asyncio.gather(*(lookup(call) for call in calls)))
+    report("async", time.perf_counter() - start, latencies)
+
+
+if __name__ == "__main__":
+    recording = Recording(sys.argv[1])
+    factor = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    calls = callsigns(recording)
+    if not calls:
+        sys.exit(f"no callsign lookups in {sys.argv[1]}")
+
+    print(f"{len(calls)} lookups, recorded latency x{factor}, {concurrency} at a time")
+    run_sync(recording, calls, factor, concurrency)
+    asyncio.run(run_async(recording, calls, factor, concurrency))
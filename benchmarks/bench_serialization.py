@@ -0,0 +1,54 @@
+"""
+qrztools: serialization benchmark
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+
+Compares the serialization methods of the result objects with ``dataclasses.asdict()`` and ``json.dumps()``.
+Run with ``python benchmarks/bench_serialization.py``.
+"""
+
+
+import json
+import timeit
+from dataclasses import asdict
+from datetime import datetime
+
+from gridtools import Grid, LatLong
+
+from qrztools import QrzCallsignData
+from qrztools.qrztools import Address, Dxcc, GeoLocSource, Name
+
+
+NUMBER = 20000
+
+record = QrzCallsignData(
+    call="W1AW", xref="W1AW", aliases=["W1AW/P", "W1AW/M"], lic_class="C",
+    name=Name(first="Hiram", name="Maxim"),
+    address=Address(line1="225 Main St", line2="Newington", state="CT", zip="06111", country="United States"),
+    dxcc=Dxcc(id=291, name="United States"),
+    latlong=LatLong(41.714775, -72.727260), grid=Grid("FN31pr"),
+    effective_date=datetime(2000, 1, 20), expire_date=datetime(2030, 1, 20), geoloc=GeoLocSource.USER,
+)
+
+
+def legacy() -> str:
+    # asdict() leaves the datetimes, enums, and gridtools objects for json.dumps() to handle
+    return json.dumps(asdict(record), default=str)
+
+
+def report(name: str, func) -> None:
+    secs = timeit.timeit(func, number=NUMBER)
+    print(f"{name:<28}{secs / NUMBER * 1e6:8.2f} us")
+
+
+if __name__ == "__main__":
+    report("asdict", lambda: asdict(record))
+    report("asdict + json.dumps", legacy)
+    report("to_dict", record.to_dict)
+    report("to_json", record.to_json)
+    report("from_json", lambda: QrzCallsignData.from_json(record.to_json()))
+    try:
+        report("to_msgpack", record.to_msgpack)
+    except ModuleNotFoundError:
+        print("msgpack not installed, skipping")
@@ -0,0 +1,125 @@
+"""
+qrztools: thread safety stress test
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+
+Shares one QrzSync object between many threads, against a local stand-in for the QRZ XML API that expires each
+session key ten seconds after it is issued. Checks that every expiry causes exactly one login, and that every
+lookup returns the record it asked for. A lookup rejected for an expired key is retried once with the new key, so
+the key lifetime has to stay well above the slowest lookup, which grows with the number of threads. Run with
+``python benchmarks/stress_threads.py [threads] [lookups per thread]``.
+"""
+
+
+import asyncio
+import json
+import multiprocessing
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+import qrztools.qrztools
+from qrztools import PoolConfig, QrzSync
+
+
+EXPIRE_EVERY = 10.0
+
+HEAD = '<?xml version="1.0" ?><QRZDatabase version="1.34" xmlns="http://xmldata.qrz.com">'
+
+
+class StandIn:
+    # like QRZ, each login issues a new key, which expires a while after it was issued
+    def __init__(self):
+        self.key = ""
+        self.expires = 0.0
+        self.queries = 0
+        self.logins = 0
+        self.expiries = 0
+
+    def reply(self, query):
+        self.queries += 1
+        if "username" in query:
+            self.logins += 1
+            self.key = uuid.uuid4().hex
+            self.expires = time.monotonic() + EXPIRE_EVERY
+            return f"<Session><Key>{self.key}</Key><SubExp>Wed Jan 1 2030</SubExp></Session>"
+        if query.get("s") != self.key or time.monotonic() >= self.expires:
+            if query.get("s") == self.key and self.expires:
+                self.expiries += 1
+                self.expires = 0.0
+            return "<Session><Error>Session Timeout</Error></Session>"
+        call = query["callsign"]
+        return (f"<Callsign><call>{call}</call><xref>{call}</xref><geoloc>user</geoloc></Callsign>"
+                f"<Session><Key>{query['s']}</Key><SubExp>Wed Jan 1 2030</SubExp></Session>")
+
+
+def serve(port: "multiprocessing.Value") -> None:
+    # runs on an event loop in its own process, so the server doesn't compete with the client threads for the GIL
+    stand_in = StandIn()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                path = head.split(b" ", 2)[1].decode()
+                if path == "/stats":
+                    body = json.dumps({"queries": stand_in.queries, "logins": stand_in.logins,
+                                       "expiries": stand_in.expiries}).encode()
+                else:
+                    query = dict(p.split("=", 1) for p in urlsplit(path).query.split(";") if "=" in p)
+                    body = (HEAD + stand_in.reply(query) + "</QRZDatabase>").encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/xml\r\nContent-Length: %d\r\n\r\n" % len(body)
+                             + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    async def main() -> None:
+        server = await asyncio.start_server(handle, "127.0.0.1", 0, backlog=1024)
+        port.value = server.sockets[0].getsockname()[1]
+        await server.serve_forever()
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    port = multiprocessing.Value("i", 0)
+    server = multiprocessing.Process(target=serve, args=(port,), daemon=True)
+    server.start()
+    while not port.value:
+        time.sleep(0.01)
+    qrztools.qrztools.BASE_URL = f"http://127.0.0.1:{port.value}/?"
+
+    qrz = QrzSync("user", "pass", pool=PoolConfig(pool_maxsize=threads))
+    errors = []
+    mismatches = []
+
+    def worker(n: int) -> None:
+        for i in range(lookups):
+            call = f"K{n}X{i}"
+            try:
+                if qrz.get_callsign(call).call != call:
+                    mismatches.append(call)
+            except Exception as e:
+                errors.append(repr(e))
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(worker, range(threads)))
+    qrz.close()
+    with urlopen(f"http://127.0.0.1:{port.value}/stats") as resp:
+        stats = json.load(resp)
+    server.terminate()
+
+    print(f"{threads} threads x {lookups} lookups, {stats['queries']} queries")
+    print(f"logins: {stats['logins']}, key expiries: {stats['expiries']}")
+    print(f"errors: {len(errors)}, wrong records: {len(mismatches)}")
+    ok = not errors and not mismatches and stats["logins"] <= stats["expiries"] + 1
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
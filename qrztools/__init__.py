@@ -12,13 +12,27 @@ from warnings import warn
 
 from .__info__ import __version__  # noqa: F401
 
-from .qrztools import QrzError, QrzCallsignData, QrzDxccData, QrzAbc  # noqa: F401
+from .qrztools import (QrzError, QrzTimeoutError, QrzCircuitOpenError, QrzCallsignData, QrzDxccData,  # noqa: F401
+                       QrzAbc, PoolConfig, HedgeConfig)
+from .callsign import ParsedCallsign, parse_callsign  # noqa: F401
+from .cache import BioCache, RecordCache  # noqa: F401
+from .adif import AdifReader, EnrichStats, enrich_adif, enrich_adif_async, enrich_record, write_record  # noqa: F401
+from .ratelimit import RateLimiter  # noqa: F401
+from .breaker import BreakerState, CircuitBreaker  # noqa: F401
+from .scheduler import Priority, Scheduler  # noqa: F401
+from .watchlist import FieldChange, RecordChange, Watchlist, AsyncWatchlist, diff_records  # noqa: F401
+from .transport import (Transport, AsyncTransport, TransportResponse, Recording,  # noqa: F401
+                        RecordingTransport, AsyncRecordingTransport, ReplayTransport, AsyncReplayTransport)
 
 warn("This library is now deprecated. Use callsignlookuptools instead.", DeprecationWarning, stacklevel=2)
 
 if find_spec("requests"):
-    from .qrzsync import QrzSync  # noqa: F401
+    from .qrzsync import QrzSync, RequestsTransport  # noqa: F401
 if find_spec("aiohttp"):
-    from .qrzasync import QrzAsync  # noqa: F401
+    from .qrzasync import QrzAsync, AiohttpTransport, OffloadConfig, ParseStats  # noqa: F401
+if find_spec("httpx"):
+    from .http2 import HttpxTransport, AsyncHttpxTransport  # noqa: F401
+if find_spec("numpy"):
+    from .geo import SpatialIndex, SpatialMatch  # noqa: F401
 if not find_spec("requests") and not find_spec("aiohttp"):
     raise ModuleNotFoundError("At least one of requests or aiohttp needs to be installed to use qrztools")
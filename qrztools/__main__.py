@@ -8,12 +8,11 @@ Released under the terms of the BSD 3-Clause license.
 
 import argparse
 from getpass import getpass
-from dataclasses import asdict
 from typing import Dict, Any
 from enum import Enum
 from sys import stderr
 
-from qrztools import QrzSync, QrzError
+from qrztools import QrzSync, QrzError, RecordCache, enrich_adif
 
 try:
     from rich.console import Console
@@ -62,6 +61,10 @@ parser.add_argument("-b", "--bio", "--biography", required=False, type=str, meta
 parser.add_argument("-d", "--dxcc", required=False, type=str, metavar="NUM|CALL|all", dest="dxcc",
                     action="append", help=("The callsign or DXCC entity number to look up, or 'all' "
                                            "to get all DXCC entities. Warning: 'all' gives a lot of data"))
+parser.add_argument("-a", "--enrich-adif", required=False, type=str, nargs=2, metavar=("INFILE", "OUTFILE"),
+                    dest="enrich_adif", action="store",
+                    help=("Fill in grid, DXCC, zones, name, and QTH in an ADIF log from QRZ data. "
+                          "The log is streamed, so it can be of any size"))
 args = parser.parse_args()
 
 if args.pretty:
@@ -80,7 +83,7 @@ else:
     password = getpass("QRZ Password: ")
 
 
-qrz = QrzSync(username=username, password=password)
+qrz = QrzSync(username=username, password=password, cache=RecordCache())
 
 print()
 
@@ -91,13 +94,13 @@ if args.call:
             if args.pretty:
                 c.print(
                     Panel.fit(
-                        tabulate(asdict(res), True),
+                        tabulate(res.to_dict(), True),
                         title=f"Callsign: {call}",
                         border_style=Style(color="green")
                     )
                 )
             else:
-                print(tabulate(asdict(res)))
+                print(tabulate(res.to_dict()))
         except QrzError as e:
             if args.pretty:
                 ec.print(
@@ -144,7 +147,7 @@ if args.dxcc:
         try:
             results = qrz.get_dxcc(dxcc)
             if isinstance(results, list):
-                resses = {res.name: tabulate(asdict(res), args.pretty) for res in results}
+                resses = {res.name: tabulate(res.to_dict(), args.pretty) for res in results}
                 if args.pretty:
                     c.print(
                         Panel.fit(
@@ -168,13 +171,13 @@ if args.dxcc:
                 if args.pretty:
                     c.print(
                         Panel.fit(
-                            tabulate(asdict(res), True),
+                            tabulate(res.to_dict(), True),
                             title=f"DXCC: {dxcc}",
                             border_style=Style(color="green")
                         )
                     )
                 else:
-                    print(tabulate(asdict(res)))
+                    print(tabulate(res.to_dict()))
         except QrzError as e:
             if args.pretty:
                 ec.print(
@@ -188,3 +191,35 @@ if args.dxcc:
             else:
                 print(e)
         print()
+
+if args.enrich_adif:
+    infile, outfile = args.enrich_adif
+    try:
+        with open(infile, encoding="utf-8", errors="surrogateescape") as inf, \
+                open(outfile, "w", encoding="utf-8", errors="surrogateescape") as outf:
+            stats = enrich_adif(qrz, inf, outf)
+        summary = (f"{stats.records} records, {stats.lookups} callsigns looked up, "
+                   f"{stats.errors} not found")
+        if args.pretty:
+            c.print(
+                Panel.fit(
+                    summary,
+                    title=f"ADIF: {infile} -> {outfile}",
+                    border_style=Style(color="green")
+                )
+            )
+        else:
+            print(summary)
+    except (QrzError, OSError) as e:
+        if args.pretty:
+            ec.print(
+                Panel.fit(
+                    str(e),
+                    title=f"ADIF: {infile}",
+                    style=Style(color="red"),
+                    border_style=Style(color="red")
+                )
+            )
+        else:
+            print(e)
+    print()
@@ -0,0 +1,385 @@
+"""
+qrztools: ADIF log enrichment
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+"""
+
+
+import asyncio
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple, TYPE_CHECKING
+
+from gridtools import Grid, LatLong
+
+from .qrztools import QrzCallsignData, QrzError
+from .callsign import ParsedCallsign, parse_callsign
+from .scheduler import Priority
+
+if TYPE_CHECKING:
+    from .qrzsync import QrzSync
+    from .qrzasync import QrzAsync
+
+
+#: an ADIF record, as a mapping of uppercase field names to values, in file order
+AdifRecord = Dict[str, str]
+
+_NO_GRID = Grid(LatLong(0, 0)).grid
+# the end of the header, or of the first record if the file has no header
+_HEADER_END = re.compile(r"<(EOH|EOR)>", re.IGNORECASE)
+
+
+def _name(data: QrzCallsignData) -> str:
+    return data.name.formatted_name or f"{data.name.first} {data.name.name}".strip()
+
+
+#: functions getting the value of each ADIF field from callsign data. An empty value means unknown.
+FIELDS: Dict[str, Callable[[QrzCallsignData], str]] = {
+    "GRIDSQUARE": lambda data: data.grid.grid if data.grid.grid != _NO_GRID else "",
+    "DXCC": lambda data: str(data.dxcc.id) if data.dxcc.id else "",
+    "COUNTRY": lambda data: data.dxcc.name,
+    "CQZ": lambda data: str(data.cq_zone) if data.cq_zone else "",
+    "ITUZ": lambda data: str(data.itu_zone) if data.itu_zone else "",
+    "NAME": _name,
+    "QTH": lambda data: data.address.line2,
+    "STATE": lambda data: data.address.state,
+}
+
+#: fields of :data:`FIELDS` that describe where a station is. They are not filled in for callsigns with a prefix or a
+#: location suffix, e.g. ``VE3/K1ABC``, ``W1AW/MM`` or ``W1AW/4``, since the station is then away from the address in
+#: its QRZ record.
+LOCATION_FIELDS = frozenset({"GRIDSQUARE", "DXCC", "COUNTRY", "CQZ", "ITUZ", "QTH", "STATE"})
+
+# the callsign data fields each field of FIELDS is computed from, so enrichment only decodes those
+_DATA_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "GRIDSQUARE": ("grid",),
+    "DXCC": ("dxcc",),
+    "COUNTRY": ("dxcc",),
+    "CQZ": ("cq_zone",),
+    "ITUZ": ("itu_zone",),
+    "NAME": ("name",),
+    "QTH": ("address",),
+    "STATE": ("address",),
+}
+
+# suffixes that don't move a station away from home
+_HOME_SUFFIXES = frozenset({"", "QRP", "QRPP"})
+
+
+@dataclass
+class EnrichStats:
+    """Statistics about an ADIF enrichment run"""
+    #: number of records processed
+    records: int = 0
+    #: number of callsigns looked up
+    lookups: int = 0
+    #: number of callsigns that could not be looked up
+    errors: int = 0
+
+
+class AdifReader:
+    """Reads ADIF (``.adi``) records from a text stream one at a time, without loading the whole file.
+    Field lengths are counted in characters.
+
+    :param stream: the stream to read from
+    :type stream: TextIO
+    :param chunk_size: the number of characters to read at a time
+    :type chunk_size: int
+    """
+    def __init__(self, stream: TextIO, chunk_size: int = 65536):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        #: the header of the file, including the ``<EOH>`` tag, or ``""`` if the file has none
+        self.header = ""
+        self._read_header()
+
+    def __iter__(self) -> Iterator[AdifRecord]:
+        record: AdifRecord = {}
+        while True:
+            tag = self._next_tag()
+            if tag is None:
+                break
+            name, _, spec = tag.partition(":")
+            name = name.upper()
+            if name == "EOR":
+                yield record
+                record = {}
+            elif spec:
+                length = int(spec.partition(":")[0])
+                record[name] = self._take(length)
+
+    def _read_header(self) -> None:
+        self._fill(1)
+        if self._buf.startswith("<"):
+            return
+        start = 0
+        while True:
+            match = _HEADER_END.search(self._buf, start)
+            if match is not None:
+                if match.group(1).upper() == "EOH":
+                    self.header = self._buf[:match.end()]
+                    self._pos = match.end()
+                # otherwise a record ended first, so the file has no header and only text before its first record
+                return
+            # only the new chunk is searched, with enough overlap to find a tag split between chunks
+            start = max(len(self._buf) - 4, 0)
+            if not self._read_more():
+                return
+
+    def _next_tag(self) -> Optional[str]:
+        while True:
+            start = self._buf.find("<", self._pos)
+            end = self._buf.find(">", start) if start >= 0 else -1
+            if end >= 0:
+                self._pos = end + 1
+                return self._buf[start + 1:end]
+            if start < 0:
+                self._pos = len(self._buf)
+            if not self._read_more():
+                return None
+
+    def _take(self, length: int) -> str:
+        self._fill(length)
+        value = self._buf[self._pos:self._pos + length]
+        self._pos += length
+        return value
+
+    def _read_more(self) -> bool:
+        # buffers another chunk, returns False if the end of the stream was already reached
+        unread = len(self._buf) - self._pos
+        self._fill(unread + self._chunk_size)
+        return len(self._buf) - self._pos > unread
+
+    def _fill(self, size: int) -> None:
+        # makes sure at least size unread characters are buffered, unless the end of the stream is reached
+        if len(self._buf) - self._pos >= size:
+            return
+        self._buf = self._buf[self._pos:]
+        self._pos = 0
+        while len(self._buf) < size and not self._eof:
+            chunk = self._stream.read(self._chunk_size)
+            if not chunk:
+                self._eof = True
+            self._buf += chunk
+
+
+def write_record(stream: TextIO, record: AdifRecord) -> None:
+    """Writes an ADIF record to a text stream.
+
+    :param stream: the stream to write to
+    :type stream: TextIO
+    :param record: the record
+    :type record: AdifRecord
+    """
+    stream.write("".join(f"<{name}:{len(value)}>{value} " for name, value in record.items()) + "<EOR>\n")
+
+
+def enrich_record(record: AdifRecord, data: QrzCallsignData, fields: Iterable[str] = FIELDS,
+                  overwrite: bool = False) -> None:
+    """Fills in fields of an ADIF record from callsign data.
+
+    :param record: the record to enrich
+    :type record: AdifRecord
+    :param data: the callsign data of the station worked
+    :type data: QrzCallsignData
+    :param fields: the names of the fields to fill in, from :data:`FIELDS`
+    :type fields: Iterable[str]
+    :param overwrite: whether to replace values already in the record
+    :type overwrite: bool
+    """
+    for name in fields:
+        if not overwrite and record.get(name):
+            continue
+        value = FIELDS[name](data)
+        if value:
+            record[name] = value
+
+
+class _Enricher:
+    # state shared by the sync and async pipelines: the bounded memo of looked up callsigns and the statistics.
+    # The memo holds the field values computed from each record, in the order of fields, rather than the whole record.
+    def __init__(self, fields: Sequence[str], overwrite: bool, memo_size: int):
+        self.fields = fields
+        self.overwrite = overwrite
+        self.memo_size = memo_size
+        self.memo: "OrderedDict[str, Optional[Tuple[str, ...]]]" = OrderedDict()
+        # the results for the window being enriched, kept until it is written even if they leave the memo
+        self.window: Dict[str, Optional[Tuple[str, ...]]] = {}
+        self.stats = EnrichStats()
+        # the callsign data fields to look up, or None for whole records if a field's source isn't known
+        self.lookup_fields: Optional[List[str]] = None
+        if all(name in _DATA_FIELDS for name in fields):
+            self.lookup_fields = sorted({data_field for name in fields for data_field in _DATA_FIELDS[name]})
+
+    def pending(self, window: List[AdifRecord]) -> List[str]:
+        calls: Dict[str, None] = {}
+        for record in window:
+            parsed = self.parse(record)
+            call = parsed.base if parsed is not None else ""
+            if not call or call in self.window or call in calls:
+                continue
+            if call in self.memo:
+                self.memo.move_to_end(call)
+                self.window[call] = self.memo[call]
+            else:
+                calls[call] = None
+        return list(calls)
+
+    def store(self, call: str, data: Optional[QrzCallsignData]) -> None:
+        self.stats.lookups += 1
+        values = None
+        if data is None:
+            self.stats.errors += 1
+        else:
+            values = tuple(FIELDS[name](data) for name in self.fields)
+        self.window[call] = values
+        self.memo[call] = values
+        while len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
+
+    def write(self, stream: TextIO, window: List[AdifRecord]) -> None:
+        for record in window:
+            parsed = self.parse(record)
+            values = self.window.get(parsed.base) if parsed is not None else None
+            if parsed is not None and values is not None:
+                at_home = not parsed.prefix and parsed.suffix in _HOME_SUFFIXES
+                for name, value in zip(self.fields, values):
+                    # an empty value means unknown
+                    if value and (at_home or name not in LOCATION_FIELDS) and (self.overwrite or not record.get(name)):
+                        record[name] = value
+            write_record(stream, record)
+            self.stats.records += 1
+        self.window.clear()
+
+    @staticmethod
+    def parse(record: AdifRecord) -> Optional[ParsedCallsign]:
+        try:
+            return parse_callsign(record.get("CALL", ""))
+        except QrzError:
+            return None
+
+
+def _windows(reader: AdifReader, size: int) -> Iterator[List[AdifRecord]]:
+    window: List[AdifRecord] = []
+    for record in reader:
+        window.append(record)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def _start(reader: AdifReader, outfile: TextIO) -> None:
+    if reader.header:
+        outfile.write(reader.header + "\n")
+
+
+def enrich_adif(qrz: "QrzSync", infile: TextIO, outfile: TextIO, fields: Sequence[str] = tuple(FIELDS),
+                overwrite: bool = False, window: int = 1000, workers: int = 8,
+                memo_size: int = 100000) -> EnrichStats:
+    """Streams an ADIF log from ``infile`` to ``outfile``, filling in fields from QRZ.
+
+    Records are read ``window`` at a time, and each callsign not looked up yet is looked up once, concurrently,
+    before the window is written out in order. Memory use is bounded by ``window`` and ``memo_size``, whatever the
+    size of the log: only the fields needed are decoded from each reply, and only their values are remembered.
+    Callsigns that can't be looked up, whatever the error, are left as they are and counted in
+    :attr:`EnrichStats.errors`.
+
+    Callsigns are looked up without their prefix and suffix designators. For a callsign with a prefix or a location
+    suffix, e.g. ``VE3/K1ABC`` or ``W1AW/MM``, the QRZ record describes the station at home, so only the fields not
+    in :data:`LOCATION_FIELDS` are filled in, to keep the DXCC entity and zones of the log right.
+
+    :param qrz: the QRZ object to look up callsigns with
+    :type qrz: QrzSync
+    :param infile: the stream to read the log from
+    :type infile: TextIO
+    :param outfile: the stream to write the enriched log to
+    :type outfile: TextIO
+    :param fields: the names of the fields to fill in, from :data:`FIELDS`
+    :type fields: Sequence[str]
+    :param overwrite: whether to replace values already in the log
+    :type overwrite: bool
+    :param window: the number of records to buffer
+    :type window: int
+    :param workers: the number of concurrent lookups, made from threads sharing ``qrz``
+    :type workers: int
+    :param memo_size: the number of looked up callsigns to remember
+    :type memo_size: int
+    :return: statistics about the run
+    :rtype: EnrichStats
+    """
+    reader = AdifReader(infile)
+    enricher = _Enricher(fields, overwrite, memo_size)
+    _start(reader, outfile)
+
+    def lookup(call: str) -> Optional[QrzCallsignData]:
+        try:
+            return qrz.get_callsign(call, fields=enricher.lookup_fields)
+        except Exception:
+            # network and parsing errors only leave the callsign unenriched, rather than ending the run
+            return None
+
+    if not qrz.session_key:
+        qrz.warm_up()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for records in _windows(reader, window):
+            calls = enricher.pending(records)
+            for call, data in zip(calls, executor.map(lookup, calls)):
+                enricher.store(call, data)
+            enricher.write(outfile, records)
+    return enricher.stats
+
+
+async def enrich_adif_async(qrz: "QrzAsync", infile: TextIO, outfile: TextIO, fields: Sequence[str] = tuple(FIELDS),
+                            overwrite: bool = False, window: int = 1000, workers: int = 8,
+                            memo_size: int = 100000, priority: Priority = Priority.LOW) -> EnrichStats:
+    """Like :func:`enrich_adif`, but looks up callsigns with a :class:`QrzAsync` object.
+
+    :param qrz: the QRZ object to look up callsigns with
+    :type qrz: QrzAsync
+    :param infile: the stream to read the log from
+    :type infile: TextIO
+    :param outfile: the stream to write the enriched log to
+    :type outfile: TextIO
+    :param fields: the names of the fields to fill in, from :data:`FIELDS`
+    :type fields: Sequence[str]
+    :param overwrite: whether to replace values already in the log
+    :type overwrite: bool
+    :param window: the number of records to buffer
+    :type window: int
+    :param workers: the number of concurrent lookups
+    :type workers: int
+    :param memo_size: the number of looked up callsigns to remember
+    :type memo_size: int
+    :param priority: the priority to look up callsigns with, if ``qrz`` has a :class:`Scheduler`
+    :type priority: Priority
+    :return: statistics about the run
+    :rtype: EnrichStats
+    """
+    reader = AdifReader(infile)
+    enricher = _Enricher(fields, overwrite, memo_size)
+    _start(reader, outfile)
+    semaphore = asyncio.Semaphore(workers)
+
+    async def lookup(call: str) -> Optional[QrzCallsignData]:
+        async with semaphore:
+            try:
+                return await qrz.get_callsign(call, priority=priority, fields=enricher.lookup_fields)
+            except Exception:
+                return None
+
+    if not qrz.session_key:
+        await qrz.warm_up()
+    for records in _windows(reader, window):
+        calls = enricher.pending(records)
+        for call, data in zip(calls, await asyncio.gather(*(lookup(call) for call in calls))):
+            enricher.store(call, data)
+        enricher.write(outfile, records)
+    return enricher.stats
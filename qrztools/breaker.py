@@ -0,0 +1,159 @@
+"""
+qrztools: circuit breaking
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+"""
+
+
+import enum
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional, Tuple
+
+from .qrztools import QrzCircuitOpenError
+
+
+class BreakerState(enum.Enum):
+    """The state of a :class:`CircuitBreaker`"""
+    #: queries are sent normally
+    CLOSED = "closed"
+    #: queries fail immediately
+    OPEN = "open"
+    #: a limited number of probe queries are sent to find out if QRZ is back
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Stops sending queries to QRZ while it is failing, so lookups fail fast instead of each waiting for a network
+    error. Can be shared between several :class:`QrzSync` and :class:`QrzAsync` objects.
+
+    The breaker opens after ``failures`` consecutive failed queries, or when at least ``failure_rate`` of the last
+    ``window`` queries failed. While open, queries raise :class:`QrzCircuitOpenError` without being sent, and
+    callsign lookups are served from the cache instead if possible, with :attr:`QrzCallsignData.stale` set. After
+    ``reset_timeout`` seconds, up to ``probes`` queries are let through (half-open). If they all succeed the breaker
+    closes again, and if any fails it opens for another ``reset_timeout``.
+
+    Failed queries are ones that could not get a valid reply from QRZ: network errors, timeouts, and HTTP errors.
+    Errors reported by QRZ, like a callsign not being found, are not failures.
+
+    :param failures: the number of consecutive failures that opens the breaker, ``0`` to disable
+    :type failures: int
+    :param failure_rate: the fraction of failures in the last ``window`` queries that opens the breaker,
+        ``None`` to disable
+    :type failure_rate: Optional[float]
+    :param window: the number of recent queries the failure rate is computed over
+    :type window: int
+    :param reset_timeout: seconds to stay open before probing
+    :type reset_timeout: float
+    :param probes: the number of successful probe queries needed to close
+    :type probes: int
+    :param on_state_change: a function called with the old and new state whenever the state changes
+    :type on_state_change: Optional[Callable[[BreakerState, BreakerState], None]]
+    """
+    def __init__(self, failures: int = 5, failure_rate: Optional[float] = 0.5, window: int = 20,
+                 reset_timeout: float = 30, probes: int = 1,
+                 on_state_change: Optional[Callable[[BreakerState, BreakerState], None]] = None):
+        self._failures = failures
+        self._failure_rate = failure_rate
+        self._reset_timeout = reset_timeout
+        self._probes = max(probes, 1)
+        self._on_state_change = on_state_change
+        self._state = BreakerState.CLOSED
+        # outcomes of recent queries, True for a failure
+        self._outcomes: "deque[bool]" = deque(maxlen=window)
+        self._consecutive = 0
+        self._opened = 0.0
+        self._probing = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> BreakerState:
+        """
+        :getter: gets the state of the breaker. An open breaker only becomes half-open when the next query is checked
+        :rtype: BreakerState
+        """
+        return self._state
+
+    def check(self) -> None:
+        """Checks whether a query can be sent. Each successful check must be followed by :meth:`record_success` or
+        :meth:`record_failure` once the query completes, or by :meth:`release` if it is abandoned.
+
+        :raises QrzCircuitOpenError: if the breaker is open
+        """
+        with self._lock:
+            change = None
+            if self._state is BreakerState.OPEN:
+                if time.monotonic() - self._opened < self._reset_timeout:
+                    raise QrzCircuitOpenError("QRZ is unavailable (circuit breaker open)")
+                change = self._set_state(BreakerState.HALF_OPEN)
+            if self._state is BreakerState.HALF_OPEN:
+                if self._probing >= self._probes:
+                    raise QrzCircuitOpenError("QRZ is unavailable (circuit breaker open)")
+                self._probing += 1
+        self._notify(change)
+
+    def record_success(self) -> None:
+        """Records a query that got a valid reply"""
+        with self._lock:
+            change = None
+            if self._state is BreakerState.HALF_OPEN:
+                self._probing -= 1
+                self._probe_successes += 1
+                if self._probe_successes >= self._probes:
+                    change = self._set_state(BreakerState.CLOSED)
+            elif self._state is BreakerState.CLOSED:
+                self._consecutive = 0
+                self._outcomes.append(False)
+        self._notify(change)
+
+    def record_failure(self) -> None:
+        """Records a query that failed"""
+        with self._lock:
+            change = None
+            if self._state is BreakerState.HALF_OPEN:
+                change = self._set_state(BreakerState.OPEN)
+            elif self._state is BreakerState.CLOSED:
+                self._consecutive += 1
+                self._outcomes.append(True)
+                if self._tripped():
+                    change = self._set_state(BreakerState.OPEN)
+        self._notify(change)
+
+    def release(self) -> None:
+        """Gives back a checked query that was abandoned before it completed, e.g. because it was cancelled, without
+        recording a success or a failure. If the breaker is half-open, another probe query can then be sent."""
+        with self._lock:
+            if self._state is BreakerState.HALF_OPEN and self._probing > 0:
+                self._probing -= 1
+
+    def reset(self) -> None:
+        """Closes the breaker and forgets past queries"""
+        with self._lock:
+            change = self._set_state(BreakerState.CLOSED) if self._state is not BreakerState.CLOSED else None
+        self._notify(change)
+
+    def _tripped(self) -> bool:
+        if self._failures and self._consecutive >= self._failures:
+            return True
+        if self._failure_rate is None or len(self._outcomes) < (self._outcomes.maxlen or 0):
+            return False
+        return sum(self._outcomes) >= self._failure_rate * len(self._outcomes)
+
+    def _set_state(self, state: BreakerState) -> Tuple[BreakerState, BreakerState]:
+        # must be called with the lock held, and the returned change passed to _notify once it is released
+        old, self._state = self._state, state
+        self._probing = 0
+        self._probe_successes = 0
+        if state is BreakerState.OPEN:
+            self._opened = time.monotonic()
+        elif state is BreakerState.CLOSED:
+            self._consecutive = 0
+            self._outcomes.clear()
+        return old, state
+
+    def _notify(self, change: Optional[Tuple[BreakerState, BreakerState]]) -> None:
+        if change is not None and self._on_state_change is not None:
+            self._on_state_change(*change)
@@ -0,0 +1,292 @@
+"""
+qrztools: caching
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+"""
+
+
+import copy
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, List, Optional, Set, Tuple
+
+from .qrztools import QrzCallsignData, QrzError
+from .callsign import parse_callsign
+
+
+class _BioEntry:
+    __slots__ = ("biodate", "html_date", "html")
+
+    def __init__(self) -> None:
+        #: the latest bio update date seen in a callsign lookup
+        self.biodate = datetime.min
+        #: the bio update date the stored HTML belongs to
+        self.html_date = datetime.min
+        #: the compressed HTML
+        self.html = b""
+
+
+class BioCache:
+    """A cache for bio HTML, used by :meth:`QrzAbc.get_bio`.
+
+    Bios are stored compressed and keyed on the callsign and the bio update date (``biodate``). The date is learned
+    from callsign lookups (:attr:`QrzCallsignData.bio_updated`), so a cached bio is only served while the last lookup
+    of that callsign shows the same date, and is fetched again once it moves.
+
+    :param max_entries: the maximum number of callsigns to keep, least recently used first out
+    :type max_entries: int
+    :param level: the zlib compression level to store bios with
+    :type level: int
+    """
+    def __init__(self, max_entries: int = 1024, level: int = 6):
+        self._max_entries = max_entries
+        self._level = level
+        self._entries: "OrderedDict[str, _BioEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def update_biodate(self, callsign: str, biodate: datetime) -> None:
+        """Records the bio update date of a callsign, as seen in a callsign lookup.
+
+        :param callsign: the callsign
+        :type callsign: str
+        :param biodate: the date the bio was last updated
+        :type biodate: datetime
+        """
+        if biodate == datetime.min:
+            return
+        with self._lock:
+            entry = self._entry(callsign.upper())
+            entry.biodate = biodate
+
+    def get(self, callsign: str) -> Optional[str]:
+        """Gets the cached bio of a callsign, if it is still current.
+
+        :param callsign: the callsign
+        :type callsign: str
+        :return: the bio HTML, or ``None`` if not cached or out of date
+        :rtype: Optional[str]
+        """
+        with self._lock:
+            entry = self._entries.get(callsign.upper())
+            if entry is None or not entry.html or entry.html_date != entry.biodate:
+                return None
+            self._entries.move_to_end(callsign.upper())
+            html = entry.html
+        return zlib.decompress(html).decode()
+
+    def put(self, callsign: str, html: str) -> None:
+        """Stores the bio of a callsign. The bio is only stored if the bio update date of the callsign is known.
+
+        :param callsign: the callsign
+        :type callsign: str
+        :param html: the bio HTML
+        :type html: str
+        """
+        compressed = zlib.compress(html.encode(), self._level)
+        with self._lock:
+            entry = self._entries.get(callsign.upper())
+            if entry is None or entry.biodate == datetime.min:
+                return
+            entry.html_date = entry.biodate
+            entry.html = compressed
+
+    def clear(self) -> None:
+        """Removes all entries from the cache"""
+        with self._lock:
+            self._entries.clear()
+
+    def _entry(self, callsign: str) -> _BioEntry:
+        entry = self._entries.get(callsign)
+        if entry is None:
+            entry = self._entries[callsign] = _BioEntry()
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(callsign)
+        return entry
+
+
+class _RecordEntry:
+    __slots__ = ("record", "stored", "hits")
+
+    def __init__(self, record: QrzCallsignData) -> None:
+        self.record = record
+        self.stored = time.monotonic()
+        self.hits = 0
+
+
+class RecordCache:
+    """A cache for callsign lookup results, used by :meth:`QrzAbc.get_callsign`.
+
+    Entries are fresh for ``ttl`` seconds. After that, they are still served for up to ``stale_ttl`` more seconds
+    while the client refreshes them in the background (stale-while-revalidate), so lookups of popular callsigns
+    rarely wait on QRZ.
+
+    :param ttl: seconds an entry is fresh for
+    :type ttl: float
+    :param stale_ttl: seconds an expired entry is still served for while it is being refreshed
+    :type stale_ttl: float
+    :param max_entries: the maximum number of records to keep, least recently used first out
+    :type max_entries: int
+    """
+    def __init__(self, ttl: float = 3600, stale_ttl: float = 86400, max_entries: int = 10000):
+        self._ttl = ttl
+        self._stale_ttl = stale_ttl
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[str, _RecordEntry]" = OrderedDict()
+        self._refreshing: Set[str] = set()
+        self._listeners: List[Callable[[QrzCallsignData], None]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def ttl(self) -> float:
+        """
+        :getter: gets the number of seconds an entry is fresh for
+        :rtype: float
+        """
+        return self._ttl
+
+    @property
+    def stale_ttl(self) -> float:
+        """
+        :getter: gets the number of seconds an expired entry is still served for
+        :rtype: float
+        """
+        return self._stale_ttl
+
+    def lookup(self, callsign: str) -> Tuple[Optional[QrzCallsignData], bool]:
+        """Looks up a callsign in the cache.
+
+        :param callsign: the callsign
+        :type callsign: str
+        :return: the cached record (or ``None`` if not cached or too old), and whether it should be refreshed
+        :rtype: Tuple[Optional[QrzCallsignData], bool]
+        """
+        key = callsign.upper()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, False
+            age = time.monotonic() - entry.stored
+            if age > self._ttl + self._stale_ttl:
+                return None, False
+            entry.hits += 1
+            self._entries.move_to_end(key)
+            record = entry.record
+        return copy.copy(record), age > self._ttl
+
+    def put(self, record: QrzCallsignData) -> None:
+        """Stores a record under its callsign, the callsign it was looked up with, and its aliases,
+        so that all of them resolve to the same entry.
+
+        :param record: the callsign data
+        :type record: QrzCallsignData
+        """
+        entry = _RecordEntry(copy.copy(record))
+        keys = {record.call}
+        for alias in [record.xref, *record.aliases]:
+            try:
+                keys.add(parse_callsign(alias).base)
+            except QrzError:
+                continue
+        with self._lock:
+            for key in keys - {""}:
+                old = self._entries.get(key)
+                if old is not None:
+                    entry.hits = max(entry.hits, old.hits)
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        for listener in self._listeners:
+            listener(entry.record)
+
+    def get_stale(self, callsign: str) -> Optional[QrzCallsignData]:
+        """Gets the cached record of a callsign however old it is, as long as it has not been evicted.
+        Used when QRZ can't be reached.
+
+        :param callsign: the callsign
+        :type callsign: str
+        :return: the cached record, or ``None`` if not cached
+        :rtype: Optional[QrzCallsignData]
+        """
+        with self._lock:
+            entry = self._entries.get(callsign.upper())
+            if entry is None:
+                return None
+            record = entry.record
+        return copy.copy(record)
+
+    def records(self) -> List[QrzCallsignData]:
+        """Gets all cached records, including expired ones.
+
+        :return: the records
+        :rtype: List[QrzCallsignData]
+        """
+        with self._lock:
+            return list({id(entry): entry.record for entry in self._entries.values()}.values())
+
+    def add_listener(self, listener: Callable[[QrzCallsignData], None]) -> None:
+        """Adds a function to be called with each record stored in the cache.
+
+        :param listener: the function
+        :type listener: Callable[[QrzCallsignData], None]
+        """
+        self._listeners.append(listener)
+
+    def hottest(self, count: int, within: float = 0) -> List[str]:
+        """Gets the most used callsigns that are expired, or will expire soon.
+
+        :param count: the maximum number of callsigns to return
+        :type count: int
+        :param within: also include entries that will expire in this many seconds
+        :type within: float
+        :return: the callsigns, most used first
+        :rtype: List[str]
+        """
+        now = time.monotonic()
+        with self._lock:
+            # entries are stored under several keys, so dedupe them by their record's callsign
+            candidates = {
+                entry.record.call: entry.hits for entry in self._entries.values()
+                if entry.hits and self._ttl - within < now - entry.stored <= self._ttl + self._stale_ttl
+            }
+        return sorted(candidates, key=candidates.__getitem__, reverse=True)[:count]
+
+    def begin_refresh(self, callsign: str) -> bool:
+        """Marks a callsign as being refreshed.
+
+        :param callsign: the callsign
+        :type callsign: str
+        :return: ``False`` if the callsign is already being refreshed
+        :rtype: bool
+        """
+        with self._lock:
+            if callsign.upper() in self._refreshing:
+                return False
+            self._refreshing.add(callsign.upper())
+            return True
+
+    def end_refresh(self, callsign: str) -> None:
+        """Marks a callsign as no longer being refreshed.
+
+        :param callsign: the callsign
+        :type callsign: str
+        """
+        with self._lock:
+            self._refreshing.discard(callsign.upper())
+
+    def clear(self) -> None:
+        """Removes all entries from the cache"""
+        with self._lock:
+            self._entries.clear()
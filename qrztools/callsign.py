@@ -0,0 +1,65 @@
+"""
+qrztools: callsign parsing
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+"""
+
+
+import re
+from dataclasses import dataclass
+
+from .qrztools import QrzError
+
+
+#: suffixes that modify how a station operates, rather than where
+MODIFIERS = frozenset({"P", "M", "MM", "AM", "A", "QRP", "QRPP", "LH", "R", "B", "J", "LGT"})
+
+# callsigns end in a digit followed by letters, while location designators like VE3 or 3D2 usually end in a digit
+_CALL_END = re.compile(r"[0-9][A-Z]+$")
+
+
+@dataclass(frozen=True)
+class ParsedCallsign:
+    """A callsign split into its base callsign and prefix/suffix designators, e.g. ``VE3/K1ABC/P``"""
+    #: the base callsign, which is what gets looked up, e.g. ``K1ABC``
+    base: str
+    #: the prefix designator, e.g. ``VE3``
+    prefix: str = ""
+    #: the suffix designator, e.g. ``P``
+    suffix: str = ""
+
+    def __str__(self) -> str:
+        return "/".join(x for x in (self.prefix, self.base, self.suffix) if x)
+
+
+def parse_callsign(callsign: str) -> ParsedCallsign:
+    """Splits a callsign into its base callsign and prefix/suffix designators.
+    This is done locally, without querying QRZ.
+
+    :param callsign: the callsign, e.g. ``W1AW/P``, ``VE3/K1ABC``, or ``K1ABC/MM``
+    :type callsign: str
+    :return: the parsed callsign
+    :rtype: ParsedCallsign
+    :raises QrzError: if the callsign is not valid
+    """
+    parts = callsign.strip().upper().split("/")
+    if len(parts) > 3 or not all(part.isalnum() for part in parts):
+        raise QrzError("Invalid Callsign")
+
+    if len(parts) == 1:
+        return ParsedCallsign(parts[0])
+    if len(parts) == 3:
+        return ParsedCallsign(parts[1], prefix=parts[0], suffix=parts[2])
+
+    first, second = parts
+    if second in MODIFIERS or second.isdigit():
+        return ParsedCallsign(first, suffix=second)
+    first_call, second_call = bool(_CALL_END.search(first)), bool(_CALL_END.search(second))
+    if first_call != second_call:
+        return ParsedCallsign(first, suffix=second) if first_call else ParsedCallsign(second, prefix=first)
+    # a location designator is usually shorter than the callsign it is attached to, e.g. VE3/K1ABC or K1ABC/VE3.
+    # PREFIX/CALL is the usual form when operating abroad, so that is assumed for parts of the same length.
+    if len(first) > len(second):
+        return ParsedCallsign(first, suffix=second)
+    return ParsedCallsign(second, prefix=first)
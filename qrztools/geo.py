@@ -0,0 +1,193 @@
+"""
+qrztools: spatial index
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+"""
+
+
+import math
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Set, Tuple, Union
+
+import numpy as np
+from gridtools import Grid, LatLong
+
+from .qrztools import QrzCallsignData
+from .cache import RecordCache
+
+
+EARTH_RADIUS = 6371
+
+
+@dataclass
+class SpatialMatch:
+    """A result of a :class:`SpatialIndex` query"""
+    #: the matching station
+    record: QrzCallsignData
+    #: great circle distance from the query point in kilometres
+    distance: float
+    #: bearing from the query point in degrees
+    bearing: float
+
+
+class SpatialIndex:
+    """An index of callsign records by location, for nearest-station and radius queries.
+
+    Records are bucketed into a grid of ``cell_size`` by ``cell_size`` degree cells, so queries only look at the
+    records in nearby cells. Distances and bearings for those are computed together with numpy. The index can be fed
+    by hand with :meth:`add`, or attached to a :class:`RecordCache` with :meth:`attach` to grow as lookups come in.
+
+    Records with an unknown location (``0, 0``) are ignored.
+
+    :param cell_size: the size of the grid cells in degrees
+    :type cell_size: float
+    """
+    def __init__(self, cell_size: float = 2.0):
+        self._cell_size = cell_size
+        self._lat_cells = math.ceil(180 / cell_size)
+        self._lon_cells = math.ceil(360 / cell_size)
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+        self._rows: Dict[str, int] = {}
+        self._records: List[QrzCallsignData] = []
+        self._row_cells: List[Tuple[int, int]] = []
+        # unit-sphere coordinates, and lat/long in radians, of each row
+        self._xyz = np.empty((64, 3))
+        self._latlong = np.empty((64, 2))
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def attach(self, cache: RecordCache) -> None:
+        """Adds all records in a cache, and keeps adding records as they are stored in it.
+
+        :param cache: the cache
+        :type cache: RecordCache
+        """
+        for record in cache.records():
+            self.add(record)
+        cache.add_listener(self.add)
+
+    def add(self, record: QrzCallsignData) -> None:
+        """Adds a record to the index, replacing any record with the same callsign.
+
+        :param record: the callsign data
+        :type record: QrzCallsignData
+        """
+        lat, long = record.latlong.lat, record.latlong.long
+        if lat == 0 and long == 0:
+            return
+        rad_lat, rad_long = math.radians(lat), math.radians(long)
+        with self._lock:
+            row = self._rows.get(record.call)
+            if row is not None:
+                # the station may have moved, so it is taken out of its old cell and the row is reused
+                self._cells[self._row_cells[row]].remove(row)
+                self._records[row] = record
+                self._row_cells[row] = self._cell(lat, long)
+            else:
+                row = self._rows[record.call] = len(self._records)
+                if row == len(self._xyz):
+                    self._xyz = np.resize(self._xyz, (row * 2, 3))
+                    self._latlong = np.resize(self._latlong, (row * 2, 2))
+                self._records.append(record)
+                self._row_cells.append(self._cell(lat, long))
+            self._xyz[row] = (math.cos(rad_lat) * math.cos(rad_long), math.cos(rad_lat) * math.sin(rad_long),
+                              math.sin(rad_lat))
+            self._latlong[row] = (rad_lat, rad_long)
+            self._cells.setdefault(self._row_cells[row], []).append(row)
+
+    def within(self, point: Union[LatLong, Grid, str], radius: float) -> List[SpatialMatch]:
+        """Finds all stations within a distance of a point.
+
+        :param point: the point, as a lat/long, a grid, or a grid locator string
+        :type point: Union[LatLong, Grid, str]
+        :param radius: the distance in kilometres
+        :type radius: float
+        :return: the matching stations, nearest first
+        :rtype: List[SpatialMatch]
+        """
+        lat, long = self._point(point)
+        with self._lock:
+            rows = self._candidates(lat, long, radius)
+            dist, bearing = self._measure(lat, long, rows)
+            records = self._records
+        mask = dist <= radius
+        return self._matches(records, rows[mask], dist[mask], bearing[mask])
+
+    def nearest(self, point: Union[LatLong, Grid, str], count: int = 1) -> List[SpatialMatch]:
+        """Finds the stations nearest to a point.
+
+        :param point: the point, as a lat/long, a grid, or a grid locator string
+        :type point: Union[LatLong, Grid, str]
+        :param count: the number of stations to find
+        :type count: int
+        :return: the nearest stations, nearest first
+        :rtype: List[SpatialMatch]
+        """
+        lat, long = self._point(point)
+        # widen the search until enough stations are found within the searched radius
+        radius = self._cell_size * 111.2
+        with self._lock:
+            while True:
+                rows = self._candidates(lat, long, radius)
+                dist, bearing = self._measure(lat, long, rows)
+                if np.count_nonzero(dist <= radius) >= count or radius >= math.pi * EARTH_RADIUS:
+                    break
+                radius *= 2
+            records = self._records
+        order = np.argsort(dist, kind="stable")[:count]
+        return self._matches(records, rows[order], dist[order], bearing[order], presorted=True)
+
+    def _candidates(self, lat: float, long: float, radius: float) -> np.ndarray:
+        d_lat = math.degrees(radius / EARTH_RADIUS)
+        lat_lo = max(int((lat - d_lat + 90) // self._cell_size), 0)
+        lat_hi = min(int((lat + d_lat + 90) // self._cell_size), self._lat_cells - 1)
+        cos_lat = min(math.cos(math.radians(lat - d_lat)), math.cos(math.radians(lat + d_lat)))
+        if lat - d_lat <= -90 or lat + d_lat >= 90 or cos_lat <= 0 or d_lat / cos_lat >= 180:
+            lon_cells: Set[int] = set(range(self._lon_cells))
+        else:
+            d_long = d_lat / cos_lat
+            lon_lo = int((long - d_long + 180) // self._cell_size)
+            lon_hi = int((long + d_long + 180) // self._cell_size)
+            lon_cells = {i % self._lon_cells for i in range(lon_lo, lon_hi + 1)}
+        rows: List[int] = []
+        for i in range(lat_lo, lat_hi + 1):
+            for j in lon_cells:
+                rows.extend(self._cells.get((i, j), ()))
+        return np.array(rows, dtype=np.intp)
+
+    def _measure(self, lat: float, long: float, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        rad_lat, rad_long = math.radians(lat), math.radians(long)
+        point = np.array([math.cos(rad_lat) * math.cos(rad_long), math.cos(rad_lat) * math.sin(rad_long),
+                          math.sin(rad_lat)])
+        chord = np.linalg.norm(self._xyz[rows] - point, axis=1)
+        dist = 2 * EARTH_RADIUS * np.arcsin(np.clip(chord / 2, 0, 1))
+
+        lat2, long2 = self._latlong[rows, 0], self._latlong[rows, 1]
+        d_long = long2 - rad_long
+        y = np.sin(d_long) * np.cos(lat2)
+        x = math.cos(rad_lat) * np.sin(lat2) - math.sin(rad_lat) * np.cos(lat2) * np.cos(d_long)
+        bearing = (np.degrees(np.arctan2(y, x)) + 360) % 360
+        return dist, bearing
+
+    def _matches(self, records: List[QrzCallsignData], rows: np.ndarray, dist: np.ndarray, bearing: np.ndarray,
+                 presorted: bool = False) -> List[SpatialMatch]:
+        if not presorted:
+            order = np.argsort(dist, kind="stable")
+            rows, dist, bearing = rows[order], dist[order], bearing[order]
+        return [SpatialMatch(records[r], float(d), float(b)) for r, d, b in zip(rows, dist, bearing)]
+
+    def _cell(self, lat: float, long: float) -> Tuple[int, int]:
+        return (min(int((lat + 90) // self._cell_size), self._lat_cells - 1),
+                min(int((long + 180) // self._cell_size), self._lon_cells - 1))
+
+    @staticmethod
+    def _point(point: Union[LatLong, Grid, str]) -> Tuple[float, float]:
+        if isinstance(point, str):
+            point = Grid(point)
+        if isinstance(point, Grid):
+            point = point.latlong
+        return point.lat, point.long
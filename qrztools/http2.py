@@ -0,0 +1,91 @@
+"""
+qrztools: HTTP/2 transports
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+"""
+
+
+from typing import Optional
+
+import httpx
+
+from .qrztools import PoolConfig, QrzTimeoutError
+from .transport import Transport, AsyncTransport, TransportResponse
+
+
+def _limits(pool: PoolConfig) -> httpx.Limits:
+    return httpx.Limits(max_connections=pool.limit or None, max_keepalive_connections=pool.pool_maxsize,
+                        keepalive_expiry=pool.keepalive_timeout)
+
+
+class HttpxTransport(Transport):
+    """A transport for :class:`QrzSync` using httpx. With HTTP/2, concurrent queries are multiplexed over a single
+    connection.
+
+    :param client: An httpx client to use for requests. If not given, a new client without timeouts of its own is
+        created using ``pool``
+    :type client: Optional[httpx.Client]
+    :param pool: Connection pool settings for the client created by this object
+    :type pool: Optional[PoolConfig]
+    :param http2: whether to use HTTP/2
+    :type http2: bool
+    """
+    def __init__(self, client: Optional[httpx.Client] = None, pool: Optional[PoolConfig] = None, http2: bool = True):
+        if client is None:
+            client = httpx.Client(http2=http2, limits=_limits(pool if pool is not None else PoolConfig()),
+                                  timeout=None)
+        self._client = client
+
+    @property
+    def client(self) -> httpx.Client:
+        """
+        :getter: gets the httpx client
+        :rtype: httpx.Client
+        """
+        return self._client
+
+    def get(self, url: str, timeout: Optional[float] = None) -> TransportResponse:
+        try:
+            resp = self._client.get(url, timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT)
+        except httpx.TimeoutException as e:
+            raise QrzTimeoutError("Query timed out") from e
+        return TransportResponse(resp.status_code, resp.content, resp.encoding)
+
+    def close(self) -> None:
+        self._client.close()
+
+
+class AsyncHttpxTransport(AsyncTransport):
+    """A transport for :class:`QrzAsync` using httpx. With HTTP/2, concurrent queries are multiplexed over a single
+    connection.
+
+    :param client: An httpx client to use for requests. If not given, a new client without timeouts of its own is
+        created using ``pool``
+    :type client: Optional[httpx.AsyncClient]
+    :param pool: Connection pool settings for the client created by this object
+    :type pool: Optional[PoolConfig]
+    :param http2: whether to use HTTP/2
+    :type http2: bool
+    """
+    def __init__(self, client: Optional[httpx.AsyncClient] = None, pool: Optional[PoolConfig] = None,
+                 http2: bool = True):
+        if client is None:
+            client = httpx.AsyncClient(http2=http2, limits=_limits(pool if pool is not None else PoolConfig()),
+                                       timeout=None)
+        self._client = client
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        :getter: gets the httpx client
+        :rtype: httpx.AsyncClient
+        """
+        return self._client
+
+    async def get(self, url: str) -> TransportResponse:
+        resp = await self._client.get(url)
+        return TransportResponse(resp.status_code, resp.content, resp.encoding)
+
+    async def close(self) -> None:
+        await self._client.aclose()
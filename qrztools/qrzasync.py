@@ -6,14 +6,118 @@ Released under the terms of the BSD 3-Clause license.
 """
 
 
-from typing import Dict, List, Union, Optional
-from io import BytesIO
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Union, Optional, Set, TypeVar
+from concurrent.futures import Executor
+from contextvars import ContextVar
+from dataclasses import dataclass
+import asyncio
+import time
 
 from lxml import etree
 import aiohttp
 
 from .__info__ import __version__
-from .qrztools import QrzAbc, QrzCallsignData, QrzDxccData, QrzError, BASE_URL
+from .qrztools import (QrzAbc, QrzCallsignData, QrzDxccData, QrzError, QrzTimeoutError, QrzCircuitOpenError,
+                       PoolConfig, HedgeConfig, _LatencyTracker, _callsign_fields)
+from .cache import BioCache, RecordCache
+from .callsign import parse_callsign
+from .ratelimit import RateLimiter
+from .breaker import CircuitBreaker
+from .scheduler import Priority, Scheduler
+from .transport import AsyncRecordingTransport, AsyncTransport, Recording, TransportResponse
+
+
+_T = TypeVar("_T")
+
+# the priority of the call a query is made for, so it doesn't have to be passed down through every method
+_priority: ContextVar[Priority] = ContextVar("_priority", default=Priority.NORMAL)
+# the event loop time the call a query is made for times out at, to tell timeouts from other cancellations
+_deadline: ContextVar[Optional[float]] = ContextVar("_deadline", default=None)
+
+
+@dataclass
+class OffloadConfig:
+    """Settings for moving the parsing of large replies off the event loop in :class:`QrzAsync`.
+
+    lxml releases the GIL while it parses, so parsing in a thread leaves the event loop free to run other tasks.
+    The results are lxml trees, which can't be sent between processes, so the executor must run in this process.
+    """
+    #: replies of at least this many bytes are parsed in the executor, smaller ones are parsed on the event loop
+    parse_threshold: int = 65536
+    #: replies with at least this many records (e.g. DXCC entities) also have their results built in the executor
+    build_threshold: int = 32
+    #: the executor to use, ``None`` for the event loop's default executor
+    executor: Optional[Executor] = None
+
+
+@dataclass
+class ParseStats:
+    """Statistics about the time :class:`QrzAsync` spends parsing replies and building results from them"""
+    #: number of parsing and building steps run on the event loop
+    inline: int = 0
+    #: seconds the event loop was blocked by them
+    blocked: float = 0.0
+    #: the longest the event loop was blocked by a single step, in seconds
+    max_blocked: float = 0.0
+    #: number of parsing and building steps run in the executor
+    offloaded: int = 0
+    #: seconds spent on them in the executor, not counting time waiting for a worker
+    offloaded_time: float = 0.0
+
+
+def _timed(elapsed: List[float], func: Callable[..., _T], *args: Any) -> _T:
+    # runs in the executor, and reports the time taken through elapsed
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        elapsed[0] = time.perf_counter() - start
+
+
+class AiohttpTransport(AsyncTransport):
+    """The default transport for :class:`QrzAsync`, using aiohttp.
+
+    :param session: An aiohttp session to use for requests. If not given, a new session is created using ``pool``
+        when the transport is started
+    :type session: Optional[aiohttp.ClientSession]
+    :param pool: Connection pool settings for the session created by this object
+    :type pool: Optional[PoolConfig]
+    """
+    def __init__(self, session: Optional[aiohttp.ClientSession] = None, pool: Optional[PoolConfig] = None):
+        self._session = session
+        self._pool = pool if pool is not None else PoolConfig()
+
+    @property
+    def session(self) -> Optional[aiohttp.ClientSession]:
+        """
+        :getter: gets the aiohttp session, ``None`` if not started
+        :rtype: Optional[aiohttp.ClientSession]
+        """
+        return self._session
+
+    async def start(self) -> None:
+        """Creates a new aiohttp session, if there is no open session"""
+        if self._session is not None and not self._session.closed:
+            return
+        ttl = self._pool.dns_cache_ttl
+        connector = aiohttp.TCPConnector(
+            limit=self._pool.limit,
+            limit_per_host=self._pool.pool_maxsize,
+            keepalive_timeout=self._pool.keepalive_timeout,
+            use_dns_cache=ttl != 0,
+            ttl_dns_cache=ttl
+        )
+        self._session = aiohttp.ClientSession(connector=connector)
+
+    async def get(self, url: str) -> TransportResponse:
+        if self._session is None:
+            await self.start()
+        async with self._session.get(url) as resp:  # type: ignore
+            return TransportResponse(resp.status, await resp.read(), resp.get_encoding())
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
 
 
 class QrzAsync(QrzAbc):
@@ -27,61 +131,309 @@ class QrzAsync(QrzAbc):
     :type session_key: str
     :param useragent: Useragent for QRZ
     :type useragent: str
-    :param session: An aiohttp session to use for requests
+    :param session: An aiohttp session to use for requests. If not given, one is created by :meth:`start_session`
+        or on first use
     :type session: Optional[aiohttp.ClientSession]
+    :param pool: Connection pool settings for the session created by :meth:`start_session`
+    :type pool: Optional[PoolConfig]
+    :param transport: The transport to send queries with. Defaults to an :class:`AiohttpTransport` using ``session``
+        and ``pool``
+    :type transport: Optional[AsyncTransport]
+    :param bio_cache: A cache for bios, validated by the bio update date from callsign lookups
+    :type bio_cache: Optional[BioCache]
+    :param cache: A cache for callsign lookups. Expired entries are refreshed in a background task
+    :type cache: Optional[RecordCache]
+    :param rate_limiter: A rate limiter applied to all queries
+    :type rate_limiter: Optional[RateLimiter]
+    :param warmup: Number of connections to open with :meth:`warm_up` when entering an ``async with`` block.
+        ``0`` disables warm-up
+    :type warmup: int
+    :param timeout: Default number of seconds a call may take, including any login. ``None`` for no limit.
+        Calls that run out of time are cancelled
+    :type timeout: Optional[float]
+    :param hedge: Request hedging settings. If given, a duplicate query is sent when a reply is slower than usual
+    :type hedge: Optional[HedgeConfig]
+    :param breaker: A circuit breaker applied to all queries
+    :type breaker: Optional[CircuitBreaker]
+    :param scheduler: A scheduler that sends queries by priority. :meth:`get_callsign`, :meth:`get_callsign_raw`,
+        :meth:`get_bio`, :meth:`get_callsign_with_bio`, and :meth:`get_dxcc` take a ``priority`` argument (default
+        :attr:`Priority.NORMAL`), and background refreshes are sent with :attr:`Priority.LOW`. Duplicates of hedged
+        queries are scheduled at the priority of the call they are sent for
+    :type scheduler: Optional[Scheduler]
+    :param offload: Settings for parsing large replies off the event loop. If not given, all replies are parsed on
+        the event loop. Either way, the time spent is counted in :attr:`parse_stats`
+    :type offload: Optional[OffloadConfig]
+    :param recording: If given, every query is recorded to it with its response and how long it took, with
+        credentials and session keys scrubbed. Replay it with an :class:`AsyncReplayTransport`
+    :type recording: Optional[Recording]
+
+    Can be used as an async context manager, which starts a session (if needed) and warms up the object on entry,
+    and closes the session on exit if it was started by the context manager:
+
+    .. code-block:: python
+
+        async with QrzAsync("user", "pass", warmup=4) as qrz:
+            await qrz.get_callsign("W1AW")
     """
     def __init__(self, username: str, password: str, session_key: str = "",
                  useragent: str = f"python-qrztools-v{__version__}",
-                 session: Optional[aiohttp.ClientSession] = None):
-        self._session = session
-        super().__init__(username, password, session_key=session_key, useragent=useragent)
+                 session: Optional[aiohttp.ClientSession] = None, pool: Optional[PoolConfig] = None,
+                 bio_cache: Optional[BioCache] = None, cache: Optional[RecordCache] = None,
+                 rate_limiter: Optional[RateLimiter] = None, warmup: int = 0,
+                 transport: Optional[AsyncTransport] = None, timeout: Optional[float] = None,
+                 hedge: Optional[HedgeConfig] = None, breaker: Optional[CircuitBreaker] = None,
+                 scheduler: Optional[Scheduler] = None, offload: Optional[OffloadConfig] = None,
+                 recording: Optional[Recording] = None):
+        super().__init__(username, password, session_key=session_key, useragent=useragent, pool=pool,
+                         bio_cache=bio_cache, cache=cache, rate_limiter=rate_limiter, timeout=timeout, hedge=hedge,
+                         breaker=breaker)
+        self._owns_transport = transport is None and session is None
+        self._transport = transport if transport is not None else AiohttpTransport(session, self._pool)
+        if recording is not None:
+            self._transport = AsyncRecordingTransport(self._transport, recording)
+        self._warmup = warmup
+        self._tasks: Set[asyncio.Task] = set()
+        self._refresher: Optional[asyncio.Task] = None
+        self._scheduler = scheduler
+        self._offload = offload
+        self._parse_stats = ParseStats()
+
+    async def __aenter__(self) -> "QrzAsync":
+        await self._transport.start()
+        if self._warmup > 0:
+            await self.warm_up(self._warmup)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop_refresher()
+        if self._owns_transport:
+            await self._transport.close()
 
     @property
-    def session(self) -> aiohttp.ClientSession:
+    def session(self) -> Optional[aiohttp.ClientSession]:
         """
-        :getter: gets the aiohttp session
-        :rtype: aiohttp.ClientSession
+        :getter: gets the aiohttp session, ``None`` if not started or if the transport doesn't use aiohttp
+        :rtype: Optional[aiohttp.ClientSession]
 
-        :setter: sets the aiohttp session
+        :setter: sets the aiohttp session, replacing the transport with an :class:`AiohttpTransport`
         :type: aiohttp.ClientSession
         """
-        return self._session
+        return self._transport.session if isinstance(self._transport, AiohttpTransport) else None
 
     @session.setter
     def session(self, val: aiohttp.ClientSession) -> None:
-        self._session = val
+        self._transport = AiohttpTransport(val)
+        self._owns_transport = False
+
+    @property
+    def scheduler(self) -> Optional[Scheduler]:
+        """
+        :getter: gets the scheduler queries are sent through, ``None`` if queries are sent as they come
+        :rtype: Optional[Scheduler]
+
+        :setter: sets the scheduler
+        :type: Optional[Scheduler]
+        """
+        return self._scheduler
+
+    @scheduler.setter
+    def scheduler(self, val: Optional[Scheduler]) -> None:
+        self._scheduler = val
+
+    @property
+    def offload(self) -> Optional[OffloadConfig]:
+        """
+        :getter: gets the settings for parsing large replies off the event loop, ``None`` if all are parsed on it
+        :rtype: Optional[OffloadConfig]
+
+        :setter: sets the settings for parsing large replies off the event loop
+        :type: Optional[OffloadConfig]
+        """
+        return self._offload
+
+    @offload.setter
+    def offload(self, val: Optional[OffloadConfig]) -> None:
+        self._offload = val
+
+    @property
+    def parse_stats(self) -> ParseStats:
+        """
+        :getter: gets the statistics about the time spent parsing replies and building results, including how long
+            the event loop was blocked
+        :rtype: ParseStats
+        """
+        return self._parse_stats
+
+    @property
+    def transport(self) -> AsyncTransport:
+        """
+        :getter: gets the transport queries are sent with
+        :rtype: AsyncTransport
+
+        :setter: sets the transport
+        :type: AsyncTransport
+        """
+        return self._transport
+
+    @transport.setter
+    def transport(self, val: AsyncTransport) -> None:
+        self._transport = val
+        self._owns_transport = False
 
     async def start_session(self) -> None:
-        self._session = aiohttp.ClientSession()
+        """Starts the transport. With the default transport, this creates a new aiohttp session using the connection
+        pool settings of this object"""
+        await self._transport.start()
 
     async def close_session(self) -> None:
-        await self._session.close()
+        """Closes the transport"""
+        await self._transport.close()
 
-    async def get_callsign(self, callsign: str) -> QrzCallsignData:
-        if not callsign.isalnum():
-            raise QrzError("Invalid Callsign")
-        try:
-            await self._check_session()
-        except QrzError:
+    async def warm_up(self, connections: int = 1) -> None:
+        """Logs in (or validates the session key) and opens connections to QRZ ahead of time,
+        so the first lookup only costs one round-trip.
+
+        :param connections: the number of pooled connections to open
+        :type connections: int
+        """
+        await self._run(self._warm_up(connections), None, Priority.HIGH)
+
+    async def _warm_up(self, connections: int) -> None:
+        if self._session_key:
+            try:
+                await self._check_session()
+            except QrzError:
+                await self._login()
+        else:
             await self._login()
-        resp_xml = await self._do_query({"s": self._session_key, "callsign": callsign.upper()})
+        if connections > 1:
+            # concurrent requests can't share a connection, so each one leaves an open connection in the pool
+            await asyncio.gather(*(self._check_session() for _ in range(connections)))
+
+    def start_refresher(self, interval: float = 60, count: int = 100) -> None:
+        """Starts a background task that refreshes the most used cached callsigns before they expire.
+        Requires :attr:`cache` to be set. Refreshes go through the rate limiter like any other query.
+
+        :param interval: seconds between refresh rounds
+        :type interval: float
+        :param count: the maximum number of callsigns to refresh per round
+        :type count: int
+        """
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._run_refresher(interval, count))
+
+    async def stop_refresher(self) -> None:
+        """Stops the background task started by :meth:`start_refresher`"""
+        if self._refresher is None:
+            return
+        self._refresher.cancel()
+        try:
+            await self._refresher
+        except asyncio.CancelledError:
+            pass
+        self._refresher = None
+
+    async def get_callsign(self, callsign: str, timeout: Optional[float] = None,
+                           priority: Priority = Priority.NORMAL,
+                           fields: Optional[Iterable[str]] = None) -> QrzCallsignData:
+        names = _callsign_fields(fields)
+        callsign = parse_callsign(callsign).base
+        if self._cache is not None:
+            calldata, expired = self._cache.lookup(callsign)
+            if calldata is not None:
+                if expired and self._cache.begin_refresh(callsign):
+                    task = asyncio.create_task(self._refresh(callsign))
+                    # the event loop only keeps weak references to tasks
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                return calldata
+        try:
+            return await self._run(self._lookup_callsign(callsign, names), timeout, priority)
+        except QrzCircuitOpenError:
+            calldata = self._stale_callsign(callsign)
+            if calldata is None:
+                raise
+            return calldata
+
+    async def _lookup_callsign(self, callsign: str, fields: Optional[List[str]] = None) -> QrzCallsignData:
+        resp_xml = await self._query({"callsign": callsign})
         if isinstance(resp_xml, etree._Element):
-            return self._process_callsign(resp_xml)
+            return await self._build(resp_xml, self._process_callsign, resp_xml, fields)
         return QrzCallsignData("Unknown")
 
-    async def get_bio(self, callsign: str) -> str:
-        if not callsign.isalnum():
-            raise QrzError("Invalid Callsign")
+    async def get_callsign_raw(self, callsign: str, timeout: Optional[float] = None,
+                               priority: Priority = Priority.NORMAL) -> Dict[str, Optional[str]]:
+        callsign = parse_callsign(callsign).base
+        resp_xml = await self._run(self._query({"callsign": callsign}), timeout, priority)
+        if isinstance(resp_xml, etree._Element):
+            return await self._build(resp_xml, self._process_callsign_raw, resp_xml)
+        return {}
+
+    async def _refresh(self, callsign: str) -> None:
         try:
-            await self._check_session()
-        except QrzError:
-            await self._login()
-        bio = await self._do_query({"s": self._session_key, "html": callsign.upper()})
+            await self._run(self._lookup_callsign(callsign), None, Priority.LOW)
+        except Exception:
+            # the stale entry is kept, and the next lookup will try again
+            pass
+        finally:
+            if self._cache is not None:
+                self._cache.end_refresh(callsign)
+
+    async def _run_refresher(self, interval: float, count: int) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            if self._cache is None:
+                continue
+            for callsign in self._cache.hottest(count, within=interval):
+                if self._cache.begin_refresh(callsign):
+                    await self._refresh(callsign)
+
+    async def get_bio(self, callsign: str, timeout: Optional[float] = None,
+                      priority: Priority = Priority.NORMAL) -> str:
+        callsign = parse_callsign(callsign).base
+        if self._bio_cache is not None:
+            cached = self._bio_cache.get(callsign)
+            if cached is not None:
+                return cached
+        bio = await self._run(self._query({"html": callsign}), timeout, priority)
         if isinstance(bio, str):
+            if self._bio_cache is not None:
+                self._bio_cache.put(callsign, bio)
             return bio
+        self._process_check_session(bio)
         return ""
 
-    async def get_dxcc(self, query: Union[str, int]) -> Union[QrzDxccData, List[QrzDxccData]]:
+    async def get_callsign_with_bio(self, callsign: str, timeout: Optional[float] = None,
+                                    priority: Priority = Priority.NORMAL) -> QrzCallsignData:
+        return await self._run(self._get_callsign_with_bio(parse_callsign(callsign).base), timeout, priority)
+
+    async def _get_callsign_with_bio(self, callsign: str) -> QrzCallsignData:
+        if self._bio_cache is not None and self._bio_cache.get(callsign) is not None:
+            # the bio can probably be served from the cache, so only fetch it if the lookup shows it changed
+            calldata = await self.get_callsign(callsign, priority=_priority.get())
+            calldata.bio = await self.get_bio(callsign, priority=_priority.get())
+            return calldata
+
+        try:
+            resp_xml, bio = await self._query_concurrently({"callsign": callsign}, {"html": callsign})
+        except QrzCircuitOpenError:
+            stale = self._stale_callsign(callsign)
+            if stale is None:
+                raise
+            return stale
+        if not isinstance(resp_xml, etree._Element):
+            return QrzCallsignData("Unknown")
+        calldata = await self._build(resp_xml, self._process_callsign, resp_xml)
+        if isinstance(bio, str):
+            calldata.bio = bio
+            if self._bio_cache is not None:
+                self._bio_cache.put(callsign, bio)
+        else:
+            self._process_check_session(bio)
+        return calldata
+
+    async def get_dxcc(self, query: Union[str, int], timeout: Optional[float] = None,
+                       priority: Priority = Priority.NORMAL) -> Union[QrzDxccData, List[QrzDxccData]]:
         if isinstance(query, int):
             if query < 0:
                 raise QrzError("Invalid DXCC Entity Number")
@@ -90,33 +442,176 @@ class QrzAsync(QrzAbc):
             if not query.isalnum():
                 raise QrzError("Invalid Query")
             query = query.upper()
-        try:
-            await self._check_session()
-        except QrzError:
-            await self._login()
-        resp_xml = await self._do_query({"s": self._session_key, "dxcc": query})
+        resp_xml = await self._run(self._query({"dxcc": query}), timeout, priority)
         if isinstance(resp_xml, etree._Element):
-            return self._process_dxcc(resp_xml)
+            return await self._build(resp_xml, self._process_dxcc, resp_xml)
         return QrzDxccData()
 
     async def _login(self) -> None:
         resp_xml = await self._do_query(
-                {"username": self._username, "password": self._password, "agent": self._useragent}
+                {"username": self._username, "password": self._password, "agent": self._useragent}, hedge=False
             )
         if isinstance(resp_xml, etree._Element):
             self._process_login(resp_xml)
 
     async def _check_session(self) -> None:
-        resp_xml = await self._do_query({"s": self._session_key})
+        resp_xml = await self._do_query({"s": self._session_key}, hedge=False)
         if isinstance(resp_xml, etree._Element):
             self._process_check_session(resp_xml)
 
-    async def _do_query(self, query: Dict[str, str]) -> Union[str, etree._Element]:
-        url = BASE_URL + ";".join(f"{k}={v}" for k, v in query.items())
-        async with self._session.get(url) as resp:
-            if resp.status != 200:
-                raise QrzError(f"Unable to connect to QRZ (HTTP Error {resp.status})")
-            if "html" in query:
-                return str(await resp.text())
-            with BytesIO(await resp.read()) as resp_file:
-                return etree.parse(resp_file).getroot()
+    async def _query(self, query: Dict[str, str]) -> Union[str, etree._Element]:
+        # the session key is sent optimistically, and a new one is only requested if QRZ rejects it
+        if not self._session_key:
+            await self._login()
+        resp = await self._do_query({"s": self._session_key, **query})
+        if isinstance(resp, etree._Element) and not self._has_session_key(resp):
+            await self._login()
+            resp = await self._do_query({"s": self._session_key, **query})
+        return resp
+
+    async def _query_concurrently(self, *queries: Dict[str, str]) -> List[Union[str, etree._Element]]:
+        # like _query, but all queries share the session key validation and are sent at the same time
+        if not self._session_key:
+            await self._login()
+        resps = list(await asyncio.gather(*(self._do_query({"s": self._session_key, **q}) for q in queries)))
+        retry = [i for i, r in enumerate(resps) if isinstance(r, etree._Element) and not self._has_session_key(r)]
+        if retry:
+            await self._login()
+            retried = await asyncio.gather(*(self._do_query({"s": self._session_key, **queries[i]}) for i in retry))
+            for i, resp in zip(retry, retried):
+                resps[i] = resp
+        return resps
+
+    async def _do_query(self, query: Dict[str, str], hedge: bool = True) -> Union[str, etree._Element]:
+        breaker = self._breaker
+        if breaker is not None:
+            breaker.check()
+        scheduler = self._scheduler
+        priority = _priority.get()
+        try:
+            if scheduler is None:
+                if self._rate_limiter is not None:
+                    await self._rate_limiter.acquire_async()
+            else:
+                # the scheduler applies the rate limit itself, so higher priority queries are let through first
+                await scheduler.acquire(priority, self._rate_limiter)
+        except asyncio.CancelledError:
+            # waiting for the rate limit or the scheduler says nothing about QRZ, even if the deadline passed meanwhile
+            if breaker is not None:
+                breaker.release()
+            raise
+        try:
+            try:
+                resp = await self._send_query(self._build_url(query), hedge, self._tracker(query))
+            finally:
+                if scheduler is not None:
+                    scheduler.release(priority)
+            offload = self._offload is not None and len(resp.body) >= self._offload.parse_threshold
+            result = await self._blocking(offload, self._parse_response, query, resp)
+        except asyncio.CancelledError:
+            # a query cancelled by its deadline is counted as failed, but other cancellations say nothing about QRZ,
+            # and give back the probe slot the query may hold if the breaker is half-open
+            deadline = _deadline.get()
+            if breaker is not None:
+                if deadline is not None and asyncio.get_running_loop().time() >= deadline:
+                    breaker.record_failure()
+                else:
+                    breaker.release()
+            raise
+        except Exception:
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+    async def _build(self, resp_xml: etree._Element, func: Callable[..., _T], *args: Any) -> _T:
+        # builds results from a reply, in the executor if it has many records. The session is the only other child.
+        offload = self._offload is not None and len(resp_xml) - 1 >= self._offload.build_threshold
+        return await self._blocking(offload, func, *args)
+
+    async def _blocking(self, offload: bool, func: Callable[..., _T], *args: Any) -> _T:
+        # runs CPU-bound work in the executor or on the event loop, and counts the time it took
+        stats = self._parse_stats
+        if offload and self._offload is not None:
+            elapsed = [0.0]
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._offload.executor, _timed, elapsed,
+                                                                        func, *args)
+            finally:
+                stats.offloaded += 1
+                stats.offloaded_time += elapsed[0]
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            blocked = time.perf_counter() - start
+            stats.inline += 1
+            stats.blocked += blocked
+            stats.max_blocked = max(stats.max_blocked, blocked)
+
+    async def _send_query(self, url: str, hedge: bool, tracker: Optional[_LatencyTracker]) -> TransportResponse:
+        delay = self._hedge_delay(tracker) if hedge else None
+        return await (self._send(url, tracker) if delay is None else self._send_hedged(url, delay, tracker))
+
+    async def _send(self, url: str, tracker: Optional[_LatencyTracker]) -> TransportResponse:
+        start = time.monotonic()
+        resp = await self._transport.get(url)
+        if tracker is not None:
+            tracker.record(time.monotonic() - start)
+        return resp
+
+    async def _send_hedged(self, url: str, delay: float, tracker: Optional[_LatencyTracker]) -> TransportResponse:
+        # a duplicate query is sent if the first is slower than usual, and the first reply wins
+        tasks = [asyncio.ensure_future(self._send(url, tracker))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                tasks.append(asyncio.ensure_future(self._send_duplicate(url, tracker)))
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    error = task.exception()
+                    if error is None:
+                        return task.result()
+            raise error  # type: ignore
+        finally:
+            # also cancels both queries if the call itself is cancelled or times out
+            for task in tasks:
+                task.cancel()
+
+    async def _send_duplicate(self, url: str, tracker: Optional[_LatencyTracker]) -> TransportResponse:
+        # the duplicate of a hedged query goes through the scheduler like any other, at the priority of its call
+        scheduler = self._scheduler
+        if scheduler is None:
+            if self._rate_limiter is not None:
+                await self._rate_limiter.acquire_async()
+            return await self._send(url, tracker)
+        priority = _priority.get()
+        await scheduler.acquire(priority, self._rate_limiter)
+        try:
+            return await self._send(url, tracker)
+        finally:
+            scheduler.release(priority)
+
+    async def _run(self, aw: Awaitable[_T], timeout: Optional[float], priority: Priority) -> _T:
+        # the deadline covers everything awaited by aw, including logging in again, and cancels it when reached
+        timeout = self._timeout if timeout is None else timeout
+        token = _priority.set(priority)
+        deadline_token = None
+        try:
+            if timeout is None:
+                return await aw
+            deadline = asyncio.get_running_loop().time() + timeout
+            outer = _deadline.get()
+            deadline_token = _deadline.set(deadline if outer is None else min(deadline, outer))
+            return await asyncio.wait_for(aw, timeout)
+        except asyncio.TimeoutError:
+            raise QrzTimeoutError("Query timed out") from None
+        finally:
+            if deadline_token is not None:
+                _deadline.reset(deadline_token)
+            _priority.reset(token)
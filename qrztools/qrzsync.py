@@ -6,14 +6,77 @@ Released under the terms of the BSD 3-Clause license.
 """
 
 
-from typing import Dict, List, Union
-from io import BytesIO
+from typing import Dict, Iterable, List, Union, Optional
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed, wait
+import threading
+import time
 
 from lxml import etree
 import requests
+from requests.adapters import HTTPAdapter
 
 from .__info__ import __version__
-from .qrztools import QrzAbc, QrzCallsignData, QrzDxccData, QrzError, BASE_URL
+from .qrztools import (QrzAbc, QrzCallsignData, QrzDxccData, QrzError, QrzTimeoutError, QrzCircuitOpenError,
+                       PoolConfig, HedgeConfig, _LatencyTracker, _callsign_fields)
+from .cache import BioCache, RecordCache
+from .callsign import parse_callsign
+from .ratelimit import RateLimiter
+from .breaker import CircuitBreaker
+from .transport import Recording, RecordingTransport, Transport, TransportResponse
+
+
+class RequestsTransport(Transport):
+    """The default transport for :class:`QrzSync`, using requests.
+
+    ``requests.Session`` is not guaranteed to be thread-safe, so unless a session is given, each thread gets its own
+    session. The sessions share one connection pool.
+
+    :param session: A requests session to use for requests, shared by all threads. If not given, sessions are
+        created using ``pool``
+    :type session: Optional[requests.Session]
+    :param pool: Connection pool settings for the sessions created by this object
+    :type pool: Optional[PoolConfig]
+    """
+    def __init__(self, session: Optional[requests.Session] = None, pool: Optional[PoolConfig] = None):
+        self._session = session
+        self._adapter: Optional[HTTPAdapter] = None
+        self._local = threading.local()
+        if session is None:
+            pool = pool if pool is not None else PoolConfig()
+            self._adapter = HTTPAdapter(pool_connections=pool.pool_connections, pool_maxsize=pool.pool_maxsize,
+                                        pool_block=pool.pool_block)
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        :getter: gets the requests session. If the sessions are created by this object, gets the calling thread's
+        :rtype: requests.Session
+        """
+        if self._session is not None:
+            return self._session
+        session = getattr(self._local, "session", None)
+        if session is None:
+            # without a session given, the shared adapter is always created
+            adapter = self._adapter
+            assert adapter is not None
+            session = self._local.session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        return session
+
+    def get(self, url: str, timeout: Optional[float] = None) -> TransportResponse:
+        try:
+            with self.session.get(url, timeout=timeout) as resp:
+                return TransportResponse(resp.status_code, resp.content, resp.encoding)
+        except requests.Timeout as e:
+            raise QrzTimeoutError("Query timed out") from e
+
+    def close(self) -> None:
+        if self._session is not None:
+            self._session.close()
+        elif self._adapter is not None:
+            # the per-thread sessions hold nothing but the shared adapter and its connections
+            self._adapter.close()
 
 
 class QrzSync(QrzAbc):
@@ -27,54 +90,265 @@ class QrzSync(QrzAbc):
     :type session_key: str
     :param useragent: Useragent for QRZ
     :type useragent: str
-    :param session: A requests session to use for requests
-    :type session: requests.Session
+    :param session: A requests session to use for requests. If not given, a new session is created using ``pool``
+    :type session: Optional[requests.Session]
+    :param pool: Connection pool settings for the session created by this object
+    :type pool: Optional[PoolConfig]
+    :param transport: The transport to send queries with. Defaults to a :class:`RequestsTransport` using ``session``
+        and ``pool``
+    :type transport: Optional[Transport]
+    :param bio_cache: A cache for bios, validated by the bio update date from callsign lookups
+    :type bio_cache: Optional[BioCache]
+    :param cache: A cache for callsign lookups. Expired entries are refreshed on a background thread
+    :type cache: Optional[RecordCache]
+    :param rate_limiter: A rate limiter applied to all queries
+    :type rate_limiter: Optional[RateLimiter]
+    :param warmup: Number of connections to open with :meth:`warm_up` when entering a ``with`` block.
+        ``0`` disables warm-up
+    :type warmup: int
+    :param timeout: Default number of seconds a call may take, including any login. ``None`` for no limit
+    :type timeout: Optional[float]
+    :param hedge: Request hedging settings. If given, a duplicate query is sent when a reply is slower than usual
+    :type hedge: Optional[HedgeConfig]
+    :param breaker: A circuit breaker applied to all queries
+    :type breaker: Optional[CircuitBreaker]
+    :param recording: If given, every query is recorded to it with its response and how long it took, with
+        credentials and session keys scrubbed. Replay it with a :class:`ReplayTransport`
+    :type recording: Optional[Recording]
+
+    Can be used as a context manager, which warms up the object on entry and closes it on exit:
+
+    .. code-block:: python
+
+        with QrzSync("user", "pass", warmup=4) as qrz:
+            qrz.get_callsign("W1AW")
+
+    A single object can be used from many threads at once. Logging in is single-flight: when QRZ rejects the
+    session key, one thread logs in and the others wait for its new key, so there are no duplicate logins. With the
+    default transport, each thread gets its own ``requests.Session`` over a shared connection pool. A ``session``
+    passed in is shared by all threads as is. The caches, rate limiter, and circuit breaker are all thread-safe.
+    Properties like :attr:`cache` or :attr:`transport` should be set before the object is shared.
     """
     def __init__(self, username: str, password: str, session_key: str = "",
-                 useragent: str = f"python-qrztools-v{__version__}", session: requests.Session = requests.Session()):
-        self._session = session
-        super().__init__(username, password, session_key=session_key, useragent=useragent)
+                 useragent: str = f"python-qrztools-v{__version__}", session: Optional[requests.Session] = None,
+                 pool: Optional[PoolConfig] = None, bio_cache: Optional[BioCache] = None,
+                 cache: Optional[RecordCache] = None, rate_limiter: Optional[RateLimiter] = None, warmup: int = 0,
+                 transport: Optional[Transport] = None, timeout: Optional[float] = None,
+                 hedge: Optional[HedgeConfig] = None, breaker: Optional[CircuitBreaker] = None,
+                 recording: Optional[Recording] = None):
+        super().__init__(username, password, session_key=session_key, useragent=useragent, pool=pool,
+                         bio_cache=bio_cache, cache=cache, rate_limiter=rate_limiter, timeout=timeout, hedge=hedge,
+                         breaker=breaker)
+        self._owns_transport = transport is None and session is None
+        self._transport = transport if transport is not None else RequestsTransport(session, self._pool)
+        if recording is not None:
+            self._transport = RecordingTransport(self._transport, recording)
+        self._warmup = warmup
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        self._refresher: Optional[threading.Thread] = None
+        self._refresher_stop = threading.Event()
+        # _lock guards the executors and the refresher, _login_lock makes logins single-flight
+        self._lock = threading.Lock()
+        self._login_lock = threading.Lock()
+
+    def __enter__(self) -> "QrzSync":
+        if self._warmup > 0:
+            self.warm_up(self._warmup)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
 
     @property
-    def session(self) -> requests.Session:
+    def session(self) -> Optional[requests.Session]:
         """
-        :getter: gets the requests session
-        :rtype: requests.Session
+        :getter: gets the requests session, ``None`` if the transport doesn't use requests
+        :rtype: Optional[requests.Session]
 
-        :setter: sets the requests session
+        :setter: sets the requests session, replacing the transport with a :class:`RequestsTransport`
         :type: requests.Session
         """
-        return self._session
+        return self._transport.session if isinstance(self._transport, RequestsTransport) else None
 
     @session.setter
     def session(self, val: requests.Session) -> None:
-        self._session = val
+        self._transport = RequestsTransport(val)
+        self._owns_transport = False
+
+    @property
+    def transport(self) -> Transport:
+        """
+        :getter: gets the transport queries are sent with
+        :rtype: Transport
+
+        :setter: sets the transport
+        :type: Transport
+        """
+        return self._transport
 
-    def get_callsign(self, callsign: str) -> QrzCallsignData:
-        if not callsign.isalnum():
-            raise QrzError("Invalid Callsign")
+    @transport.setter
+    def transport(self, val: Transport) -> None:
+        self._transport = val
+        self._owns_transport = False
+
+    def close(self) -> None:
+        """Closes the transport, if it was created by this object, and stops the worker threads"""
+        self.stop_refresher()
+        with self._lock:
+            executor, self._executor = self._executor, None
+            hedge_executor, self._hedge_executor = self._hedge_executor, None
+        if executor is not None:
+            executor.shutdown()
+        if hedge_executor is not None:
+            # the losing side of a hedged query is left to finish on its own
+            hedge_executor.shutdown(wait=False)
+        if self._owns_transport:
+            self._transport.close()
+
+    def warm_up(self, connections: int = 1) -> None:
+        """Logs in (or validates the session key) and opens connections to QRZ ahead of time,
+        so the first lookup only costs one round-trip.
+
+        :param connections: the number of pooled connections to open
+        :type connections: int
+        """
+        deadline = self._deadline(None)
+        key = self._session_key
+        if key:
+            try:
+                self._check_session(deadline)
+            except QrzTimeoutError:
+                raise
+            except QrzError:
+                self._refresh_key(key, deadline)
+        else:
+            self._refresh_key(key, deadline)
+        if connections > 1:
+            # concurrent requests can't share a connection, so each one leaves an open connection in the pool
+            with ThreadPoolExecutor(max_workers=connections) as executor:
+                list(executor.map(lambda _: self._check_session(deadline), range(connections)))
+
+    def start_refresher(self, interval: float = 60, count: int = 100) -> None:
+        """Starts a background thread that refreshes the most used cached callsigns before they expire.
+        Requires :attr:`cache` to be set. Refreshes go through the rate limiter like any other query.
+
+        :param interval: seconds between refresh rounds
+        :type interval: float
+        :param count: the maximum number of callsigns to refresh per round
+        :type count: int
+        """
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self._refresher_stop.clear()
+            self._refresher = threading.Thread(target=self._run_refresher, args=(interval, count), daemon=True)
+            self._refresher.start()
+
+    def stop_refresher(self) -> None:
+        """Stops the background thread started by :meth:`start_refresher`"""
+        with self._lock:
+            refresher, self._refresher = self._refresher, None
+            if refresher is None:
+                return
+            self._refresher_stop.set()
+        refresher.join()
+
+    def get_callsign(self, callsign: str, timeout: Optional[float] = None,
+                     fields: Optional[Iterable[str]] = None) -> QrzCallsignData:
+        names = _callsign_fields(fields)
+        callsign = parse_callsign(callsign).base
+        if self._cache is not None:
+            calldata, expired = self._cache.lookup(callsign)
+            if calldata is not None:
+                if expired and self._cache.begin_refresh(callsign):
+                    threading.Thread(target=self._refresh, args=(callsign,), daemon=True).start()
+                return calldata
         try:
-            self._check_session()
-        except QrzError:
-            self._login()
-        resp_xml = self._do_query({"s": self._session_key, "callsign": callsign.upper()})
+            return self._lookup_callsign(callsign, self._deadline(timeout), names)
+        except QrzCircuitOpenError:
+            calldata = self._stale_callsign(callsign)
+            if calldata is None:
+                raise
+            return calldata
+
+    def _lookup_callsign(self, callsign: str, deadline: Optional[float],
+                         fields: Optional[List[str]] = None) -> QrzCallsignData:
+        resp_xml = self._query({"callsign": callsign}, deadline)
         if isinstance(resp_xml, etree._Element):
-            return self._process_callsign(resp_xml)
+            return self._process_callsign(resp_xml, fields)
         return QrzCallsignData("Unknown")
 
-    def get_bio(self, callsign: str) -> str:
-        if not callsign.isalnum():
-            raise QrzError("Invalid Callsign")
+    def get_callsign_raw(self, callsign: str, timeout: Optional[float] = None) -> Dict[str, Optional[str]]:
+        callsign = parse_callsign(callsign).base
+        resp_xml = self._query({"callsign": callsign}, self._deadline(timeout))
+        if isinstance(resp_xml, etree._Element):
+            return self._process_callsign_raw(resp_xml)
+        return {}
+
+    def _refresh(self, callsign: str) -> None:
         try:
-            self._check_session()
-        except QrzError:
-            self._login()
-        bio = self._do_query({"s": self._session_key, "html": callsign.upper()})
+            self._lookup_callsign(callsign, self._deadline(None))
+        except Exception:
+            # the stale entry is kept, and the next lookup will try again
+            pass
+        finally:
+            if self._cache is not None:
+                self._cache.end_refresh(callsign)
+
+    def _run_refresher(self, interval: float, count: int) -> None:
+        while not self._refresher_stop.wait(interval):
+            if self._cache is None:
+                continue
+            for callsign in self._cache.hottest(count, within=interval):
+                if self._refresher_stop.is_set():
+                    return
+                if self._cache.begin_refresh(callsign):
+                    self._refresh(callsign)
+
+    def get_bio(self, callsign: str, timeout: Optional[float] = None) -> str:
+        callsign = parse_callsign(callsign).base
+        if self._bio_cache is not None:
+            cached = self._bio_cache.get(callsign)
+            if cached is not None:
+                return cached
+        bio = self._query({"html": callsign}, self._deadline(timeout))
         if isinstance(bio, str):
+            if self._bio_cache is not None:
+                self._bio_cache.put(callsign, bio)
             return bio
+        self._process_check_session(bio)
         return ""
 
-    def get_dxcc(self, query: Union[str, int]) -> Union[QrzDxccData, List[QrzDxccData]]:
+    def get_callsign_with_bio(self, callsign: str, timeout: Optional[float] = None) -> QrzCallsignData:
+        callsign = parse_callsign(callsign).base
+        deadline = self._deadline(timeout)
+        if self._bio_cache is not None and self._bio_cache.get(callsign) is not None:
+            # the bio can probably be served from the cache, so only fetch it if the lookup shows it changed
+            calldata = self.get_callsign(callsign, self._remaining(deadline))
+            calldata.bio = self.get_bio(callsign, self._remaining(deadline))
+            return calldata
+
+        try:
+            resp_xml, bio = self._query_concurrently({"callsign": callsign}, {"html": callsign}, deadline=deadline)
+        except QrzCircuitOpenError:
+            stale = self._stale_callsign(callsign)
+            if stale is None:
+                raise
+            return stale
+        if not isinstance(resp_xml, etree._Element):
+            return QrzCallsignData("Unknown")
+        calldata = self._process_callsign(resp_xml)
+        if isinstance(bio, str):
+            calldata.bio = bio
+            if self._bio_cache is not None:
+                self._bio_cache.put(callsign, bio)
+        else:
+            self._process_check_session(bio)
+        return calldata
+
+    def get_dxcc(self, query: Union[str, int],
+                 timeout: Optional[float] = None) -> Union[QrzDxccData, List[QrzDxccData]]:
         if isinstance(query, int):
             if query < 0:
                 raise QrzError("Invalid DXCC Entity Number")
@@ -83,31 +357,123 @@ class QrzSync(QrzAbc):
             if not query.isalnum():
                 raise QrzError("Invalid Query")
             query = query.upper()
-        try:
-            self._check_session()
-        except QrzError:
-            self._login()
-        resp_xml = self._do_query({"s": self._session_key, "dxcc": query})
+        resp_xml = self._query({"dxcc": query}, self._deadline(timeout))
         if isinstance(resp_xml, etree._Element):
             return self._process_dxcc(resp_xml)
         return QrzDxccData()
 
-    def _login(self) -> None:
-        resp_xml = self._do_query({"username": self._username, "password": self._password, "agent": self._useragent})
+    def _login(self, deadline: Optional[float] = None) -> None:
+        resp_xml = self._do_query({"username": self._username, "password": self._password, "agent": self._useragent},
+                                  deadline, hedge=False)
         if isinstance(resp_xml, etree._Element):
             self._process_login(resp_xml)
 
-    def _check_session(self) -> None:
-        resp_xml = self._do_query({"s": self._session_key})
+    def _check_session(self, deadline: Optional[float] = None) -> None:
+        resp_xml = self._do_query({"s": self._session_key}, deadline, hedge=False)
         if isinstance(resp_xml, etree._Element):
             self._process_check_session(resp_xml)
 
-    def _do_query(self, query: Dict[str, str]) -> Union[str, etree._Element]:
-        url = BASE_URL + ";".join(f"{k}={v}" for k, v in query.items())
-        with self._session.get(url) as resp:
-            if resp.status_code != 200:
-                raise QrzError(f"Unable to connect to QRZ (HTTP Error {resp.status_code})")
-            if "html" in query:
-                return resp.text
-            with BytesIO(resp.content) as resp_bytes:
-                return etree.parse(resp_bytes).getroot()
+    def _refresh_key(self, rejected: str, deadline: Optional[float]) -> str:
+        # single-flight: of the threads that had the same key rejected, only the first logs in, and the others
+        # get the key it was given
+        remaining = self._remaining(deadline)
+        if not self._login_lock.acquire(timeout=-1 if remaining is None else remaining):
+            raise QrzTimeoutError("Query timed out")
+        try:
+            if self._session_key == rejected:
+                self._login(deadline)
+            return self._session_key
+        finally:
+            self._login_lock.release()
+
+    def _query(self, query: Dict[str, str], deadline: Optional[float] = None) -> Union[str, etree._Element]:
+        # the session key is sent optimistically, and a new one is only requested if QRZ rejects it
+        key = self._session_key or self._refresh_key("", deadline)
+        resp = self._do_query({"s": key, **query}, deadline)
+        if isinstance(resp, etree._Element) and not self._has_session_key(resp):
+            key = self._refresh_key(key, deadline)
+            resp = self._do_query({"s": key, **query}, deadline)
+        return resp
+
+    def _query_concurrently(self, *queries: Dict[str, str],
+                            deadline: Optional[float] = None) -> List[Union[str, etree._Element]]:
+        # like _query, but all queries share the session key validation and run on the worker threads
+        key = self._session_key or self._refresh_key("", deadline)
+        executor = self._workers()
+        resps = list(executor.map(lambda q: self._do_query({"s": key, **q}, deadline), queries))
+        retry = [i for i, r in enumerate(resps) if isinstance(r, etree._Element) and not self._has_session_key(r)]
+        if retry:
+            key = self._refresh_key(key, deadline)
+            retried = executor.map(lambda i: self._do_query({"s": key, **queries[i]}, deadline), retry)
+            for i, resp in zip(retry, retried):
+                resps[i] = resp
+        return resps
+
+    def _workers(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._pool.pool_maxsize)
+            return self._executor
+
+    def _do_query(self, query: Dict[str, str], deadline: Optional[float] = None,
+                  hedge: bool = True) -> Union[str, etree._Element]:
+        breaker = self._breaker
+        if breaker is not None:
+            breaker.check()
+        try:
+            if self._rate_limiter is not None:
+                self._rate_limiter.acquire(self._remaining(deadline))
+        except QrzTimeoutError:
+            # running out of time waiting for the rate limit says nothing about QRZ
+            if breaker is not None:
+                breaker.release()
+            raise
+        try:
+            url = self._build_url(query)
+            tracker = self._tracker(query)
+            delay = self._hedge_delay(tracker) if hedge else None
+            resp = (self._send(url, deadline, tracker) if delay is None
+                    else self._send_hedged(url, deadline, delay, tracker))
+            result = self._parse_response(query, resp)
+        except Exception:
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+    def _send(self, url: str, deadline: Optional[float], tracker: Optional[_LatencyTracker]) -> TransportResponse:
+        start = time.monotonic()
+        resp = self._transport.get(url, self._remaining(deadline))
+        if tracker is not None:
+            tracker.record(time.monotonic() - start)
+        return resp
+
+    def _send_hedged(self, url: str, deadline: Optional[float], delay: float,
+                     tracker: Optional[_LatencyTracker]) -> TransportResponse:
+        # a duplicate query is sent if the first is slower than usual, and the first reply wins
+        with self._lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(max_workers=self._pool.pool_maxsize)
+            executor = self._hedge_executor
+        futures = [executor.submit(self._send, url, deadline, tracker)]
+        remaining = self._remaining(deadline)
+        done, _ = wait(futures, timeout=delay if remaining is None else min(delay, remaining))
+        if not done:
+            try:
+                if self._rate_limiter is not None:
+                    self._rate_limiter.acquire(self._remaining(deadline))
+                futures.append(executor.submit(self._send, url, deadline, tracker))
+            except QrzTimeoutError:
+                # no time is left to send the duplicate, so only the first query can still reply
+                pass
+        error: Optional[BaseException] = None
+        try:
+            for future in as_completed(futures, timeout=self._remaining(deadline)):
+                error = future.exception()
+                if error is None:
+                    return future.result()
+        except FuturesTimeoutError:
+            raise QrzTimeoutError("Query timed out") from None
+        raise error  # type: ignore
@@ -7,19 +7,44 @@ Released under the terms of the BSD 3-Clause license.
 
 
 import enum
+import json
+import math
+import sys
+import threading
+import time
+from collections import deque
 from abc import ABC, abstractmethod
-from dataclasses import dataclass, field
-from typing import List, Dict, Optional, Union
+from dataclasses import dataclass, field, fields
+from typing import (Any, Callable, Iterable, List, Dict, Optional, Tuple, Type, TypeVar, Union, TYPE_CHECKING,
+                    get_type_hints)
 from datetime import datetime
+from io import BytesIO
+from urllib.parse import quote
 
 from gridtools import LatLong, Grid
 from lxml import etree
 
+try:
+    import msgpack  # type: ignore
+except ModuleNotFoundError:
+    msgpack = None
+
 from .__info__ import __version__
 
+if TYPE_CHECKING:
+    from .cache import BioCache, RecordCache
+    from .ratelimit import RateLimiter
+    from .breaker import CircuitBreaker
+    from .transport import TransportResponse
+
 
 BASE_URL = "https://xmldata.qrz.com/xml/current/?"
 
+# compiled once, since compiling an expression costs about as much as evaluating it
+_CALLSIGN_XPATH = etree.XPath("/x:QRZDatabase/x:Callsign", namespaces={"x": "http://xmldata.qrz.com"})
+_SESSION_XPATH = etree.XPath("/x:QRZDatabase/x:Session", namespaces={"x": "http://xmldata.qrz.com"})
+_SESSION_KEY_XPATH = etree.XPath("/x:QRZDatabase/x:Session/x:Key", namespaces={"x": "http://xmldata.qrz.com"})
+
 
 class QrzError(Exception):
     """The exception raised when something goes wrong in qrztools"""
@@ -27,6 +52,14 @@ class QrzError(Exception):
         super().__init__(*args)
 
 
+class QrzTimeoutError(QrzError):
+    """The exception raised when a query doesn't complete before its deadline"""
+
+
+class QrzCircuitOpenError(QrzError):
+    """The exception raised when a query is not sent because QRZ is failing, see :class:`CircuitBreaker`"""
+
+
 @dataclass
 class QrzImage:
     """Represents a QRZ profile image"""
@@ -40,15 +73,33 @@ class QrzImage:
     size: int = 0
 
 
-@dataclass
+@dataclass(frozen=True)
 class Dxcc:
-    """Represents a DXCC entity in a :class:`QrzCallsignData` object"""
+    """Represents a DXCC entity in a :class:`QrzCallsignData` object. Immutable, since parsed results share one
+    instance per entity."""
     #: entity ID
     id: int = 0
     #: entity name
     name: str = ""
 
 
+_dxcc_entities: Dict[Tuple[int, str], Dxcc] = {}
+
+
+def _shared_dxcc(id: int, name: str) -> Dxcc:
+    # there are only a few hundred entities, so every record of an entity can point at the same object
+    entity = _dxcc_entities.get((id, name))
+    if entity is None:
+        entity = _dxcc_entities.setdefault((id, name), Dxcc(id, name))
+    return entity
+
+
+def _intern(val: Any) -> Any:
+    # values repeated across many records, like country names, are interned so records share one copy of them.
+    # Elements with no text parse to None, which is left alone.
+    return sys.intern(val) if isinstance(val, str) else val
+
+
 @dataclass
 class Address:
     """Represents an address in a :class:`QrzCallsignData` object"""
@@ -103,8 +154,79 @@ class Continent(enum.Enum):
     SA = "South America"
 
 
+_S = TypeVar("_S", bound="_Serializable")
+
+# (field name, encoder, decoder), an encoder or decoder of None means the value is used as-is
+_FieldPlan = List[Tuple[str, Optional[Callable[[Any], Any]], Optional[Callable[[Any], Any]]]]
+
+
+class _Serializable:
+    """Serialization to and from plain data, JSON, and msgpack, for :class:`QrzCallsignData` and
+    :class:`QrzDxccData`. Values round-trip exactly."""
+    _plan: _FieldPlan = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Converts the object into a dictionary of JSON-compatible values.
+
+        :return: the data
+        :rtype: Dict[str, Any]
+        """
+        return {name: enc(getattr(self, name)) if enc else getattr(self, name) for name, enc, _ in self._plan}
+
+    @classmethod
+    def from_dict(cls: Type[_S], data: Dict[str, Any]) -> _S:
+        """Creates an object from a dictionary made by :meth:`to_dict`.
+
+        :param data: the data
+        :type data: Dict[str, Any]
+        :return: the object
+        """
+        return cls(**{name: dec(data[name]) if dec else data[name]  # type: ignore
+                      for name, _, dec in cls._plan if name in data})
+
+    def to_json(self) -> str:
+        """Converts the object into JSON.
+
+        :return: the JSON
+        :rtype: str
+        """
+        return json.dumps(self.to_dict(), separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls: Type[_S], data: Union[str, bytes]) -> _S:
+        """Creates an object from JSON made by :meth:`to_json`.
+
+        :param data: the JSON
+        :type data: Union[str, bytes]
+        :return: the object
+        """
+        return cls.from_dict(json.loads(data))
+
+    def to_msgpack(self) -> bytes:
+        """Converts the object into msgpack. Requires the library ``msgpack``.
+
+        :return: the msgpack data
+        :rtype: bytes
+        """
+        if msgpack is None:
+            raise ModuleNotFoundError("To use msgpack serialization you must install 'msgpack'")
+        return msgpack.packb(self.to_dict())
+
+    @classmethod
+    def from_msgpack(cls: Type[_S], data: bytes) -> _S:
+        """Creates an object from msgpack data made by :meth:`to_msgpack`. Requires the library ``msgpack``.
+
+        :param data: the msgpack data
+        :type data: bytes
+        :return: the object
+        """
+        if msgpack is None:
+            raise ModuleNotFoundError("To use msgpack serialization you must install 'msgpack'")
+        return cls.from_dict(msgpack.unpackb(data))
+
+
 @dataclass
-class QrzCallsignData:
+class QrzCallsignData(_Serializable):
     """A QRZ callsign query result."""
     # callsign-related things
     #: Callsign
@@ -179,6 +301,8 @@ class QrzCallsignData:
     bio_size: int = 0
     #: date of last bio update
     bio_updated: datetime = datetime.min
+    #: bio HTML, only filled in by :meth:`QrzAbc.get_callsign_with_bio`
+    bio: str = ""
     #: QRZ profile image
     image: QrzImage = QrzImage()
     #: QRZ database serial number
@@ -191,10 +315,12 @@ class QrzCallsignData:
     mail_qsl: Optional[bool] = False
     #: whether the operator accepts Logbook of the World QSL. ``None`` if unknown
     lotw_qsl: Optional[bool] = False
+    #: ``True`` if QRZ could not be reached and this record was served from the cache instead, so it may be out of date
+    stale: bool = False
 
 
 @dataclass
-class QrzDxccData:
+class QrzDxccData(_Serializable):
     """A QRZ DXCC query result."""
     #: entity number
     dxcc: int = 0
@@ -218,14 +344,228 @@ class QrzDxccData:
     notes: str = ""
 
 
+def _encode_grid(val: Grid) -> str:
+    # the default grid is made from a lat/long, and can't be rebuilt exactly from its locator
+    return "" if val.lat == 0 and val.long == 0 else val.grid
+
+
+def _decode_grid(val: str) -> Grid:
+    return Grid(val) if val else Grid(LatLong(0, 0))
+
+
+def _enum_codec(cls: Type[enum.Enum]) -> Tuple[Callable[[Any], Any], Callable[[Any], Any]]:
+    return (lambda val: None if val is None else val.value), (lambda val: None if val is None else cls(val))
+
+
+def _nested_codec(cls: type) -> Tuple[Callable[[Any], Any], Callable[[Any], Any]]:
+    names = [f.name for f in fields(cls)]
+    return (lambda val: {name: getattr(val, name) for name in names}), (lambda val: cls(**val))
+
+
+def _field_plan(cls: type) -> _FieldPlan:
+    # worked out once per class, so serializing doesn't need to inspect the types of each field
+    codecs: Dict[Any, Tuple[Optional[Callable[[Any], Any]], Optional[Callable[[Any], Any]]]] = {
+        datetime: (datetime.isoformat, datetime.fromisoformat),
+        LatLong: (lambda val: {"lat": val.lat, "long": val.long}, lambda val: LatLong(val["lat"], val["long"])),
+        Grid: (_encode_grid, _decode_grid),
+        List[str]: (list, list),
+        GeoLocSource: _enum_codec(GeoLocSource),
+        Optional[Continent]: _enum_codec(Continent),
+        Name: _nested_codec(Name),
+        Address: _nested_codec(Address),
+        Dxcc: (_nested_codec(Dxcc)[0], lambda val: _shared_dxcc(val["id"], _intern(val["name"]))),
+        QrzImage: _nested_codec(QrzImage),
+    }
+    hints = get_type_hints(cls)
+    return [(f.name, *codecs.get(hints[f.name], (None, None))) for f in fields(cls)]
+
+
+QrzCallsignData._plan = _field_plan(QrzCallsignData)
+QrzDxccData._plan = _field_plan(QrzDxccData)
+
+
+# a callsign query result as parsed from the XML, mapping tag names to their text
+_CallsignTags = Dict[str, Any]
+
+
+def _parse_date(val: Optional[str], fmt: str) -> datetime:
+    if val is None:
+        return datetime.min
+    try:
+        return datetime.strptime(val, fmt)
+    except ValueError:
+        return datetime.min
+
+
+def _parse_qsl(val: str) -> Optional[bool]:
+    return True if val == "1" else False if val == "0" else None
+
+
+_GEOLOC_SOURCES = {
+    "user": GeoLocSource.USER,
+    "geocode": GeoLocSource.GEOCODE,
+    "grid": GeoLocSource.GRID,
+    "zip": GeoLocSource.ZIP,
+    "state": GeoLocSource.STATE,
+    "dxcc": GeoLocSource.DXCC,
+}
+
+
+def _parse_image(data: _CallsignTags) -> QrzImage:
+    img_height, img_width, img_size = [int(x) for x in data.get("imageinfo", "0:0:0").split(":")]
+    return QrzImage(url=data.get("image", ""), height=img_height, width=img_width, size=img_size)
+
+
+# functions building each field of QrzCallsignData from the parsed tags, so only the fields asked for are built
+_CALLSIGN_DECODERS: Dict[str, Callable[[_CallsignTags], Any]] = {
+    "call": lambda data: data.get("call", "").upper(),
+    "xref": lambda data: data.get("xref", "").upper(),
+    "aliases": lambda data: data["aliases"].upper().split(",") if data.get("aliases") else [],
+    "prev_call": lambda data: data.get("p_call", "").upper(),
+    "trustee": lambda data: data.get("trustee", ""),
+    "qsl_manager": lambda data: data.get("qslmgr", ""),
+    "effective_date": lambda data: _parse_date(data.get("efdate"), "%Y-%m-%d"),
+    "expire_date": lambda data: _parse_date(data.get("expdate"), "%Y-%m-%d"),
+    "lic_class": lambda data: _intern(data.get("class", "")),
+    "lic_codes": lambda data: _intern(data.get("codes", "")),
+    "name": lambda data: Name(
+        first=data.get("fname", ""),
+        name=data.get("name", ""),
+        nickname=data.get("nickname", ""),
+        formatted_name=data.get("name_fmt", "")
+    ),
+    "address": lambda data: Address(
+        attn=data.get("attn", ""),
+        line1=data.get("addr1", ""),
+        line2=data.get("addr2", ""),
+        state=_intern(data.get("state", "")),
+        zip=data.get("zip", ""),
+        country=_intern(data.get("country", "")),
+        ccode=int(data.get("ccode", 0))
+    ),
+    "dxcc": lambda data: _shared_dxcc(int(data.get("dxcc", 0)), _intern(data.get("land", ""))),
+    "latlong": lambda data: LatLong(float(data.get("lat", 0)), float(data.get("lon", 0))),
+    "grid": lambda data: Grid(data.get("grid", LatLong(0, 0))),
+    "county": lambda data: data.get("county", ""),
+    "fips": lambda data: data.get("fips", ""),
+    "msa": lambda data: data.get("MSA", ""),
+    "area_code": lambda data: data.get("AreaCode", ""),
+    "cq_zone": lambda data: int(data.get("cqzone", 0)),
+    "itu_zone": lambda data: int(data.get("ituzone", 0)),
+    "born": lambda data: _parse_date(data.get("born"), "%Y-%m-%d"),
+    "iota": lambda data: data.get("iota", ""),
+    "geoloc": lambda data: _GEOLOC_SOURCES.get(data.get("geoloc", None).lower(), GeoLocSource.NONE),
+    "timezone": lambda data: _intern(data.get("TimeZone", "")),
+    "gmt_offset": lambda data: _intern(data.get("GMTOffset", "")),
+    "observes_dst": lambda data: data.get("DST", False) == "1",
+    "user": lambda data: data.get("user", ""),
+    "email": lambda data: data.get("email", ""),
+    "url": lambda data: data.get("url", f"https://www.qrz.com/db/{data.get('call', '').upper()}"),
+    "profile_views": lambda data: int(data.get("u_views", 0)),
+    "bio_size": lambda data: int(data.get("bio", 0)),
+    "bio_updated": lambda data: _parse_date(data.get("biodate"), "%Y-%m-%d %H:%M:%S"),
+    "image": _parse_image,
+    "serial": lambda data: data.get("serial", 0),
+    "last_modified": lambda data: _parse_date(data.get("moddate"), "%Y-%m-%d %H:%M:%S"),
+    "eqsl": lambda data: _parse_qsl(data.get("eqsl", "")),
+    "mail_qsl": lambda data: _parse_qsl(data.get("mqsl", "")),
+    "lotw_qsl": lambda data: _parse_qsl(data.get("lotw", "")),
+}
+
+
+def _callsign_fields(fields: Optional[Iterable[str]]) -> Optional[List[str]]:
+    # checks the fields asked for, and adds the callsign, which every record has
+    if fields is None:
+        return None
+    names = ["call"]
+    for name in fields:
+        if name not in _CALLSIGN_DECODERS:
+            raise QrzError(f"Unknown callsign field: {name}")
+        if name not in names:
+            names.append(name)
+    return names
+
+
+@dataclass
+class PoolConfig:
+    """Connection pool settings used when :class:`QrzSync` or :class:`QrzAsync` create their own HTTP session.
+
+    Connections are kept alive and reused, so the DNS lookup and TCP/TLS handshake are only paid once per pooled
+    connection instead of once per query.
+    """
+    #: number of per-host connection pools to cache (``requests`` only)
+    pool_connections: int = 4
+    #: maximum number of connections kept open to a single host
+    pool_maxsize: int = 32
+    #: maximum number of connections open at once across all hosts, ``0`` for no limit (``aiohttp`` only)
+    limit: int = 100
+    #: wait for a free pooled connection instead of opening a throwaway one when the pool is full (``requests`` only)
+    pool_block: bool = False
+    #: seconds to keep an idle connection open for reuse (``aiohttp`` only)
+    keepalive_timeout: float = 30.0
+    #: seconds to cache DNS lookups, ``None`` to cache forever, ``0`` to disable the cache (``aiohttp`` only)
+    dns_cache_ttl: Optional[int] = 300
+
+
+@dataclass
+class HedgeConfig:
+    """Request hedging settings for :class:`QrzSync` and :class:`QrzAsync`.
+
+    When a query takes longer than most recent queries of the same kind (callsign, bio, or DXCC), a duplicate is sent
+    and whichever reply arrives first is used. This bounds tail latency when QRZ is slow, for a few percent more
+    queries. Logins and session checks are not hedged, and their latencies are not counted.
+    """
+    #: percentile of recent query latencies after which a duplicate query is sent
+    percentile: float = 95.0
+    #: number of recent query latencies to keep for each kind of query
+    window: int = 200
+    #: number of query latencies needed before hedging starts
+    min_samples: int = 20
+
+
+# the parameters naming each kind of hedged query. Each kind has its own latencies, since bio and DXCC replies are
+# larger and slower than callsign lookups, and would otherwise push up the hedge delay of lookups.
+_QUERY_KINDS = ("callsign", "html", "dxcc")
+
+
+class _LatencyTracker:
+    # a sliding window of recent query latencies
+    def __init__(self, window: int = 200):
+        self._samples: "deque[float]" = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percentile: float, min_samples: int) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < max(min_samples, 1):
+                return None
+            samples = sorted(self._samples)
+        return samples[min(max(math.ceil(percentile / 100 * len(samples)) - 1, 0), len(samples) - 1)]
+
+
 class QrzAbc(ABC):
     """The base class for QrzSync and QrzAsync. **This should not be used directly.**"""
     def __init__(self, username: str, password: str, session_key: str = "",
-                 useragent: str = f"python-qrztools-v{__version__}"):
+                 useragent: str = f"python-qrztools-v{__version__}", pool: Optional[PoolConfig] = None,
+                 bio_cache: Optional["BioCache"] = None, cache: Optional["RecordCache"] = None,
+                 rate_limiter: Optional["RateLimiter"] = None, timeout: Optional[float] = None,
+                 hedge: Optional[HedgeConfig] = None, breaker: Optional["CircuitBreaker"] = None):
         self._username = username
         self._password = password
         self._useragent = useragent
         self._session_key = session_key
+        self._pool = pool if pool is not None else PoolConfig()
+        self._bio_cache = bio_cache
+        self._cache = cache
+        self._rate_limiter = rate_limiter
+        self._timeout = timeout
+        self._hedge = hedge
+        self._breaker = breaker
+        self._latency = {kind: _LatencyTracker(hedge.window if hedge is not None else HedgeConfig.window)
+                         for kind in _QUERY_KINDS}
 
     @property
     def username(self) -> str:
@@ -272,6 +612,106 @@ class QrzAbc(ABC):
     def useragent(self, val: str) -> None:
         self._useragent = val
 
+    @property
+    def pool(self) -> PoolConfig:
+        """
+        :getter: gets the connection pool settings
+        :rtype: PoolConfig
+        """
+        return self._pool
+
+    @property
+    def bio_cache(self) -> Optional["BioCache"]:
+        """
+        :getter: gets the bio cache, ``None`` if bios are not cached
+        :rtype: Optional[BioCache]
+
+        :setter: sets the bio cache
+        :type: Optional[BioCache]
+        """
+        return self._bio_cache
+
+    @bio_cache.setter
+    def bio_cache(self, val: Optional["BioCache"]) -> None:
+        self._bio_cache = val
+
+    @property
+    def cache(self) -> Optional["RecordCache"]:
+        """
+        :getter: gets the callsign lookup cache, ``None`` if lookups are not cached
+        :rtype: Optional[RecordCache]
+
+        :setter: sets the callsign lookup cache
+        :type: Optional[RecordCache]
+        """
+        return self._cache
+
+    @cache.setter
+    def cache(self, val: Optional["RecordCache"]) -> None:
+        self._cache = val
+
+    @property
+    def rate_limiter(self) -> Optional["RateLimiter"]:
+        """
+        :getter: gets the rate limiter applied to all queries, ``None`` if not limited
+        :rtype: Optional[RateLimiter]
+
+        :setter: sets the rate limiter
+        :type: Optional[RateLimiter]
+        """
+        return self._rate_limiter
+
+    @rate_limiter.setter
+    def rate_limiter(self, val: Optional["RateLimiter"]) -> None:
+        self._rate_limiter = val
+
+    @property
+    def timeout(self) -> Optional[float]:
+        """
+        :getter: gets the default number of seconds a call may take, ``None`` for no limit
+        :rtype: Optional[float]
+
+        :setter: sets the default number of seconds a call may take
+        :type: Optional[float]
+        """
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, val: Optional[float]) -> None:
+        self._timeout = val
+
+    @property
+    def breaker(self) -> Optional["CircuitBreaker"]:
+        """
+        :getter: gets the circuit breaker applied to all queries, ``None`` if there is none
+        :rtype: Optional[CircuitBreaker]
+
+        :setter: sets the circuit breaker
+        :type: Optional[CircuitBreaker]
+        """
+        return self._breaker
+
+    @breaker.setter
+    def breaker(self, val: Optional["CircuitBreaker"]) -> None:
+        self._breaker = val
+
+    @property
+    def hedge(self) -> Optional[HedgeConfig]:
+        """
+        :getter: gets the request hedging settings, ``None`` if requests are not hedged
+        :rtype: Optional[HedgeConfig]
+
+        :setter: sets the request hedging settings
+        :type: Optional[HedgeConfig]
+        """
+        return self._hedge
+
+    @hedge.setter
+    def hedge(self, val: Optional[HedgeConfig]) -> None:
+        self._hedge = val
+        if val is not None:
+            self._latency = {kind: _LatencyTracker(val.window) for kind in _QUERY_KINDS}
+
     @property
     @abstractmethod
     def session(self):
@@ -298,35 +738,90 @@ class QrzAbc(ABC):
         self._session_key = val
 
     @abstractmethod
-    def get_callsign(self, callsign: str) -> QrzCallsignData:
-        """Gets QRZ data for a callsign.
+    def get_callsign(self, callsign: str, timeout: Optional[float] = None,
+                     fields: Optional[Iterable[str]] = None) -> QrzCallsignData:
+        """Gets QRZ data for a callsign. Prefix and suffix designators (e.g. ``VE3/K1ABC/P``) are stripped locally
+        and only the base callsign is looked up, see :func:`parse_callsign`.
+
+        If a :attr:`breaker` is open and the callsign is in the :attr:`cache`, the cached record is returned
+        with :attr:`QrzCallsignData.stale` set.
 
         :param callsign: the callsign to search for
         :type callsign: str
+        :param timeout: seconds the call may take, including any login. Defaults to :attr:`timeout`
+        :type timeout: Optional[float]
+        :param fields: the names of the :class:`QrzCallsignData` fields to fill in, e.g. ``["grid", "dxcc"]``.
+            Only these are decoded, and the others are left at their defaults, unless the record comes from the
+            :attr:`cache`. :attr:`QrzCallsignData.call` is always filled in. Partial records are not cached.
+            Defaults to all fields
+        :type fields: Optional[Iterable[str]]
         :return: the QRZ data for the callsign
         :rtype: QrzCallsignData
+        :raises QrzTimeoutError: if the call doesn't complete in time
+        :raises QrzCircuitOpenError: if the circuit breaker is open, and the callsign is not cached
+        """
+        pass
+
+    @abstractmethod
+    def get_callsign_raw(self, callsign: str, timeout: Optional[float] = None) -> Dict[str, Optional[str]]:
+        """Gets QRZ data for a callsign as sent by QRZ, without building a :class:`QrzCallsignData`. Like
+        :meth:`get_callsign`, only the base callsign is looked up. Raw results are not cached.
+
+        :param callsign: the callsign to search for
+        :type callsign: str
+        :param timeout: seconds the call may take, including any login. Defaults to :attr:`timeout`
+        :type timeout: Optional[float]
+        :return: the text of each XML tag of the callsign record, by tag name (e.g. ``{"call": "W1AW", ...}``).
+            Empty if no data was returned
+        :rtype: Dict[str, Optional[str]]
+        :raises QrzTimeoutError: if the call doesn't complete in time
+        :raises QrzCircuitOpenError: if the circuit breaker is open
         """
         pass
 
     @abstractmethod
-    def get_bio(self, callsign: str) -> str:
-        """Get the HTML for the bio of a callsign
+    def get_bio(self, callsign: str, timeout: Optional[float] = None) -> str:
+        """Get the HTML for the bio of a callsign. Like :meth:`get_callsign`, only the base callsign is looked up.
 
         :param callsign: the callsign to search for
         :type callsign: str
+        :param timeout: seconds the call may take, including any login. Defaults to :attr:`timeout`
+        :type timeout: Optional[float]
         :return: the bio HTML
         :rtype: str
+        :raises QrzTimeoutError: if the call doesn't complete in time
+        :raises QrzCircuitOpenError: if the circuit breaker is open
         """
         pass
 
     @abstractmethod
-    def get_dxcc(self, query: Union[str, int]) -> Union[QrzDxccData, List[QrzDxccData]]:
+    def get_callsign_with_bio(self, callsign: str, timeout: Optional[float] = None) -> QrzCallsignData:
+        """Gets QRZ data and the bio HTML for a callsign. Both are requested at the same time.
+
+        :param callsign: the callsign to search for
+        :type callsign: str
+        :param timeout: seconds the call may take, including any login. Defaults to :attr:`timeout`
+        :type timeout: Optional[float]
+        :return: the QRZ data for the callsign, with :attr:`QrzCallsignData.bio` filled in
+        :rtype: QrzCallsignData
+        :raises QrzTimeoutError: if the call doesn't complete in time
+        :raises QrzCircuitOpenError: if the circuit breaker is open, and the callsign is not cached
+        """
+        pass
+
+    @abstractmethod
+    def get_dxcc(self, query: Union[str, int],
+                 timeout: Optional[float] = None) -> Union[QrzDxccData, List[QrzDxccData]]:
         """Get data about a DXCC entity from a DXCC entity number or callsign.
 
         :param query: a DXCC entity number or callsign
         :type query: Union[str, int]
+        :param timeout: seconds the call may take, including any login. Defaults to :attr:`timeout`
+        :type timeout: Optional[float]
         :return: the data about the DXCC entity
         :rtype: QrzDxccData
+        :raises QrzTimeoutError: if the call doesn't complete in time
+        :raises QrzCircuitOpenError: if the circuit breaker is open
         """
         pass
 
@@ -342,134 +837,72 @@ class QrzAbc(ABC):
     def _do_query(self, query: Dict[str, str]) -> Union[str, etree._Element]:
         pass
 
-    def _process_callsign(self, resp_xml: etree._Element) -> QrzCallsignData:
+    def _deadline(self, timeout: Optional[float]) -> Optional[float]:
+        timeout = self._timeout if timeout is None else timeout
+        return None if timeout is None else time.monotonic() + timeout
+
+    @staticmethod
+    def _remaining(deadline: Optional[float]) -> Optional[float]:
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise QrzTimeoutError("Query timed out")
+        return remaining
+
+    def _stale_callsign(self, callsign: str) -> Optional[QrzCallsignData]:
+        # the fallback for when the circuit breaker is open
+        if self._cache is None:
+            return None
+        calldata = self._cache.get_stale(callsign)
+        if calldata is not None:
+            calldata.stale = True
+        return calldata
+
+    def _tracker(self, query: Dict[str, str]) -> Optional[_LatencyTracker]:
+        # the latencies of the kind of query, None for logins and session checks, which are not hedged
+        return next((self._latency[kind] for kind in _QUERY_KINDS if kind in query), None)
+
+    def _hedge_delay(self, tracker: Optional[_LatencyTracker]) -> Optional[float]:
+        if self._hedge is None or tracker is None:
+            return None
+        return tracker.percentile(self._hedge.percentile, self._hedge.min_samples)
+
+    def _build_url(self, query: Dict[str, str]) -> str:
+        # values are encoded, so a password containing ";" or "=" can't be read as another parameter
+        return BASE_URL + ";".join(f"{k}={quote(str(v), safe='')}" for k, v in query.items())
+
+    def _parse_response(self, query: Dict[str, str], resp: "TransportResponse") -> Union[str, etree._Element]:
+        if resp.status != 200:
+            raise QrzError(f"Unable to connect to QRZ (HTTP Error {resp.status})")
+        # bio queries return HTML, unless there is an error
+        if "html" in query and not resp.body[:64].lstrip().startswith(b"<?xml"):
+            return resp.text()
+        with BytesIO(resp.body) as resp_bytes:
+            return etree.parse(resp_bytes).getroot()
+
+    def _process_callsign(self, resp_xml: etree._Element, fields: Optional[List[str]] = None) -> QrzCallsignData:
+        data = self._process_callsign_raw(resp_xml)
+        if fields is not None:
+            # a partial record, which is not cached
+            return QrzCallsignData(**{name: _CALLSIGN_DECODERS[name](data) for name in fields})
+        calldata = QrzCallsignData(**{name: decode(data) for name, decode in _CALLSIGN_DECODERS.items()})
+        self._store_callsign(calldata)
+        return calldata
+
+    def _process_callsign_raw(self, resp_xml: etree._Element) -> _CallsignTags:
         # check for errors like "not found"
         self._process_check_session(resp_xml)
-        resp_xml_data = resp_xml.xpath("/x:QRZDatabase/x:Callsign", namespaces={"x": "http://xmldata.qrz.com"})
-        data = {el.tag.split("}")[1]: el.text for el in resp_xml_data[0].getiterator()}  # type: ignore
-
-        calldata = QrzCallsignData(call=data.get("call", "").upper())
-
-        calldata.xref = data.get("xref", "").upper()
-
-        aliases = data.get("aliases", [])
-        calldata.aliases = aliases.upper().split(",") if aliases else aliases
-
-        calldata.prev_call = data.get("p_call", "").upper()
-        calldata.trustee = data.get("trustee", "")
-        calldata.qsl_manager = data.get("qslmgr", "")
-
-        efdate = data.get("efdate", datetime.min)
-        try:
-            calldata.effective_date = datetime.strptime(efdate, "%Y-%m-%d") if not isinstance(efdate, datetime) else efdate
-        except ValueError:
-            calldata.effective_date = datetime.min
-
-        expdate = data.get("expdate", datetime.min)
-        try:
-            calldata.expire_date = datetime.strptime(expdate, "%Y-%m-%d") if not isinstance(expdate, datetime) else expdate
-        except ValueError:
-            calldata.expire_date = datetime.min
-
-        calldata.lic_class = data.get("class", "")
-        calldata.lic_codes = data.get("codes", "")
-
-        calldata.name = Name(
-            first=data.get("fname", ""),
-            name=data.get("name", ""),
-            nickname=data.get("nickname", ""),
-            formatted_name=data.get("name_fmt", "")
-        )
-
-        calldata.address = Address(
-            attn=data.get("attn", ""),
-            line1=data.get("addr1", ""),
-            line2=data.get("addr2", ""),
-            state=data.get("state", ""),
-            zip=data.get("zip", ""),
-            country=data.get("country", ""),
-            ccode=int(data.get("ccode", 0))
-        )
-
-        calldata.dxcc = Dxcc(int(data.get("dxcc", 0)), data.get("land", ""))
-        calldata.latlong = LatLong(float(data.get("lat", 0)), float(data.get("lon", 0)))
-        calldata.grid = Grid(data.get("grid", LatLong(0, 0)))
-        calldata.county = data.get("county", "")
-        calldata.fips = data.get("fips", "")
-        calldata.msa = data.get("MSA", "")
-        calldata.area_code = data.get("AreaCode", "")
-        calldata.cq_zone = int(data.get("cqzone", 0))
-        calldata.itu_zone = int(data.get("ituzone", 0))
-
-        born = data.get("born", datetime.min)
-        try:
-            calldata.born = datetime.strptime(born, "%Y-%m-%d") if not isinstance(born, datetime) else born
-        except ValueError:
-            calldata.born = datetime.min
-
-        calldata.iota = data.get("iota", "")
-
-        geoloc = data.get("geoloc", None).lower()
-        if geoloc == "user":
-            calldata.geoloc = GeoLocSource.USER
-        elif geoloc == "geocode":
-            calldata.geoloc = GeoLocSource.GEOCODE
-        elif geoloc == "grid":
-            calldata.geoloc = GeoLocSource.GRID
-        elif geoloc == "zip":
-            calldata.geoloc = GeoLocSource.ZIP
-        elif geoloc == "state":
-            calldata.geoloc = GeoLocSource.STATE
-        elif geoloc == "dxcc":
-            calldata.geoloc = GeoLocSource.DXCC
-
-        calldata.timezone = data.get("TimeZone", "")
-        calldata.gmt_offset = data.get("GMTOffset", "")
-
-        dst = data.get("DST", False)
-        calldata.observes_dst = True if dst == "1" else False
-
-        calldata.user = data.get("user", "")
-        calldata.email = data.get("email", "")
-        calldata.url = data.get("url", f"https://www.qrz.com/db/{calldata.call}")
-        calldata.profile_views = int(data.get("u_views", 0))
-        calldata.bio_size = int(data.get("bio", 0))
-
-        biodate = data.get("biodate", datetime.min)
-        if not isinstance(biodate, datetime):
-            try:
-                calldata.bio_updated = datetime.strptime(biodate, "%Y-%m-%d %H:%M:%S")
-            except ValueError:
-                calldata.bio_updated = datetime.min
-
-        img_info = data.get("imageinfo", "0:0:0")
-        img_height, img_width, img_size = [int(x) for x in img_info.split(":")]
-        calldata.image = QrzImage(
-            url=data.get("image", ""),
-            height=img_height,
-            width=img_width,
-            size=img_size
-        )
-
-        calldata.serial = data.get("serial", 0)
-
-        last_mod = data.get("moddate", datetime.min)
-        if not isinstance(last_mod, datetime):
-            try:
-                calldata.last_modified = datetime.strptime(last_mod, "%Y-%m-%d %H:%M:%S")
-            except ValueError:
-                calldata.last_modified = datetime.min
-
-        eqsl = data.get("eqsl", "")
-        calldata.eqsl = True if eqsl == "1" else False if eqsl == "0" else None
-
-        mail_qsl = data.get("mqsl", "")
-        calldata.mail_qsl = True if mail_qsl == "1" else False if mail_qsl == "0" else None
-
-        lotw_qsl = data.get("lotw", "")
-        calldata.lotw_qsl = True if lotw_qsl == "1" else False if lotw_qsl == "0" else None
+        record: etree._Element = _CALLSIGN_XPATH(resp_xml)[0]  # type: ignore
+        return {el.tag.split("}")[1]: el.text for el in record.iterchildren(tag=etree.Element)}
 
-        return calldata
+    def _store_callsign(self, calldata: QrzCallsignData) -> None:
+        if self._bio_cache is not None:
+            self._bio_cache.update_biodate(calldata.call, calldata.bio_updated)
+            if calldata.xref and calldata.xref != calldata.call:
+                self._bio_cache.update_biodate(calldata.xref, calldata.bio_updated)
+        if self._cache is not None:
+            self._cache.put(calldata)
 
     def _process_dxcc(self, resp_xml: etree._Element) -> Union[QrzDxccData, List[QrzDxccData]]:
         # check for errors like "not found"
@@ -483,9 +916,9 @@ class QrzAbc(ABC):
             dxccdata = QrzDxccData()
 
             dxccdata.dxcc = int(data.get("dxcc", 0))
-            dxccdata.cc2 = data.get("cc", "")
-            dxccdata.cc3 = data.get("ccc", "")
-            dxccdata.name = data.get("name", "")
+            dxccdata.cc2 = _intern(data.get("cc", ""))
+            dxccdata.cc3 = _intern(data.get("ccc", ""))
+            dxccdata.name = _intern(data.get("name", ""))
 
             cont = data.get("continent", None)
             if cont == "AF":
@@ -503,7 +936,7 @@ class QrzAbc(ABC):
 
             dxccdata.ituzone = int(data.get("ituzone", 0))
             dxccdata.cqzone = int(data.get("cqzone", 0))
-            dxccdata.utc_offset = data.get("timezone", "")
+            dxccdata.utc_offset = _intern(data.get("timezone", ""))
             dxccdata.latlong = LatLong(float(data.get("lat", 0)), float(data.get("lon", 0)))
             dxccdata.notes = data.get("notes", "")
             parsed.append(dxccdata)
@@ -513,7 +946,7 @@ class QrzAbc(ABC):
         return parsed
 
     def _process_login(self, resp_xml: etree._Element):
-        resp_xml_session = resp_xml.xpath("/x:QRZDatabase/x:Session", namespaces={"x": "http://xmldata.qrz.com"})
+        resp_xml_session = _SESSION_XPATH(resp_xml)
         resp_session = {el.tag.split("}")[1]: el.text for el in resp_xml_session[0].getiterator()}  # type: ignore
         if "Error" in resp_session:
             raise QrzError(resp_session["Error"])
@@ -522,7 +955,11 @@ class QrzAbc(ABC):
         self._session_key = resp_session["Key"]
 
     def _process_check_session(self, resp_xml: etree._Element):
-        resp_xml_session = resp_xml.xpath("/x:QRZDatabase/x:Session", namespaces={"x": "http://xmldata.qrz.com"})
+        resp_xml_session = _SESSION_XPATH(resp_xml)
         resp_session = {el.tag.split("}")[1]: el.text for el in resp_xml_session[0].getiterator()}  # type: ignore
         if "Error" in resp_session:
             raise QrzError(resp_session["Error"])
+
+    def _has_session_key(self, resp_xml: etree._Element) -> bool:
+        # QRZ only leaves out the key when the session is invalid, errors like "not found" still include it
+        return bool(_SESSION_KEY_XPATH(resp_xml))
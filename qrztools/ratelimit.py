@@ -0,0 +1,95 @@
+"""
+qrztools: rate limiting
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+"""
+
+
+import asyncio
+import threading
+import time
+from typing import Optional, Tuple
+
+from .qrztools import QrzTimeoutError
+
+
+class RateLimiter:
+    """Limits the rate of queries sent to QRZ. Can be shared between several :class:`QrzSync` and :class:`QrzAsync`
+    objects to limit them together.
+
+    :param rate: the maximum sustained number of queries per second
+    :type rate: float
+    :param burst: the number of queries that can be sent at once before the rate applies
+    :type burst: int
+    """
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self._interval = 1 / rate
+        self._burst = max(burst, 1)
+        # theoretical arrival time of the next query (GCRA)
+        self._tat = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        """
+        :getter: gets the maximum sustained number of queries per second
+        :rtype: float
+        """
+        return 1 / self._interval
+
+    @property
+    def burst(self) -> int:
+        """
+        :getter: gets the number of queries that can be sent at once
+        :rtype: int
+        """
+        return self._burst
+
+    def acquire(self, timeout: Optional[float] = None) -> None:
+        """Blocks until a query can be sent.
+
+        :param timeout: the longest to wait, ``None`` to wait as long as needed
+        :type timeout: Optional[float]
+        :raises QrzTimeoutError: if a query can't be sent within ``timeout``. No query is reserved then.
+        """
+        with self._lock:
+            tat, delay = self._next()
+            if timeout is not None and delay > timeout:
+                raise QrzTimeoutError("Timed out waiting for the rate limiter")
+            self._tat = tat + self._interval
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self) -> None:
+        """Waits until a query can be sent"""
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def try_acquire(self) -> float:
+        """Reserves a query if one can be sent right away, without waiting.
+
+        :return: ``0`` if a query can be sent now, otherwise the number of seconds until one can be sent
+        :rtype: float
+        """
+        with self._lock:
+            tat, delay = self._next()
+            if delay > 0:
+                return delay
+            self._tat = tat + self._interval
+            return 0
+
+    def _next(self) -> Tuple[float, float]:
+        # the theoretical arrival time of the next query, and how long until it can be sent. Called with the lock held.
+        now = time.monotonic()
+        tat = max(self._tat, now)
+        return tat, max(tat - now - (self._burst - 1) * self._interval, 0)
+
+    def _reserve(self) -> float:
+        with self._lock:
+            tat, delay = self._next()
+            self._tat = tat + self._interval
+            return delay
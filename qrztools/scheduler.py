@@ -0,0 +1,133 @@
+"""
+qrztools: request scheduling
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+"""
+
+
+import asyncio
+import enum
+import heapq
+import itertools
+from typing import Dict, List, Optional, Tuple
+
+from .ratelimit import RateLimiter
+
+
+class Priority(enum.IntEnum):
+    """The priority class of a :class:`QrzAsync` query. Lower values are sent first."""
+    #: interactive lookups, e.g. a user waiting on a reply
+    HIGH = 0
+    #: the default
+    NORMAL = 1
+    #: bulk lookups and background refreshes
+    LOW = 2
+
+
+class Scheduler:
+    """Schedules the queries of :class:`QrzAsync` by priority, so interactive lookups don't queue behind bulk ones.
+
+    At most ``concurrency`` queries are in flight at once, and each priority class can use up to its share of those.
+    Waiting queries are sent highest priority first, and in order within a priority. When the client has a
+    :class:`RateLimiter`, queries are only let through as the rate allows, so a higher priority query waiting for the
+    rate limit is sent before any lower priority query.
+
+    :param concurrency: the maximum number of queries in flight
+    :type concurrency: int
+    :param shares: the maximum number of queries in flight for each priority class. Classes not given can use all of
+        ``concurrency``, except :attr:`Priority.LOW` which defaults to half of it
+    :type shares: Optional[Dict[Priority, int]]
+    """
+    def __init__(self, concurrency: int = 8, shares: Optional[Dict[Priority, int]] = None):
+        self._concurrency = max(concurrency, 1)
+        self._shares = {priority: self._concurrency for priority in Priority}
+        self._shares[Priority.LOW] = max(self._concurrency // 2, 1)
+        if shares is not None:
+            self._shares.update(shares)
+        self._active = {priority: 0 for priority in Priority}
+        self._running = 0
+        self._waiters: List[Tuple[Priority, int, asyncio.Future, Optional[RateLimiter]]] = []
+        self._order = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def concurrency(self) -> int:
+        """
+        :getter: gets the maximum number of queries in flight
+        :rtype: int
+        """
+        return self._concurrency
+
+    @property
+    def shares(self) -> Dict[Priority, int]:
+        """
+        :getter: gets the maximum number of queries in flight for each priority class
+        :rtype: Dict[Priority, int]
+        """
+        return dict(self._shares)
+
+    @property
+    def waiting(self) -> int:
+        """
+        :getter: gets the number of queries waiting to be sent
+        :rtype: int
+        """
+        return sum(not waiter[2].done() for waiter in self._waiters)
+
+    async def acquire(self, priority: Priority = Priority.NORMAL, rate_limiter: Optional[RateLimiter] = None) -> None:
+        """Waits until a query can be sent. Each call must be followed by :meth:`release` once the query completes.
+
+        :param priority: the priority of the query
+        :type priority: Priority
+        :param rate_limiter: a rate limiter the query must also go through
+        :type rate_limiter: Optional[RateLimiter]
+        """
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future, rate_limiter))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the slot was granted just as the query was cancelled
+                self.release(priority)
+            raise
+
+    def release(self, priority: Priority = Priority.NORMAL) -> None:
+        """Marks a query as completed.
+
+        :param priority: the priority the query was sent with
+        :type priority: Priority
+        """
+        self._active[priority] -= 1
+        self._running -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        full: List[Tuple[Priority, int, asyncio.Future, Optional[RateLimiter]]] = []
+        while self._waiters and self._running < self._concurrency:
+            priority, _, future, rate_limiter = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self._active[priority] >= self._shares[priority]:
+                # this class has used up its share, but lower priority classes may still have room
+                full.append(heapq.heappop(self._waiters))
+                continue
+            if rate_limiter is not None:
+                delay = rate_limiter.try_acquire()
+                if delay > 0:
+                    if self._timer is None:
+                        self._timer = asyncio.get_running_loop().call_later(delay, self._wake)
+                    break
+            heapq.heappop(self._waiters)
+            self._active[priority] += 1
+            self._running += 1
+            future.set_result(None)
+        for waiter in full:
+            heapq.heappush(self._waiters, waiter)
+
+    def _wake(self) -> None:
+        self._timer = None
+        self._dispatch()
@@ -0,0 +1,337 @@
+"""
+qrztools: transports
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+"""
+
+
+import asyncio
+import base64
+import gzip
+import json
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from .qrztools import QrzError, QrzTimeoutError
+
+
+@dataclass
+class TransportResponse:
+    """A raw HTTP response returned by a transport"""
+    #: HTTP status code
+    status: int
+    #: response body
+    body: bytes
+    #: text encoding of the body, if known
+    encoding: Optional[str] = None
+
+    def text(self) -> str:
+        """Decodes the body as text.
+
+        :return: the decoded body
+        :rtype: str
+        """
+        return self.body.decode(self.encoding or "utf-8", errors="replace")
+
+
+class Transport(ABC):
+    """The base class for transports used by :class:`QrzSync`"""
+    @abstractmethod
+    def get(self, url: str, timeout: Optional[float] = None) -> TransportResponse:
+        """Sends a GET request.
+
+        :param url: the URL to request
+        :type url: str
+        :param timeout: seconds to wait for the server before giving up, ``None`` to wait as long as needed
+        :type timeout: Optional[float]
+        :return: the response
+        :rtype: TransportResponse
+        :raises QrzTimeoutError: if the server doesn't reply in time
+        """
+        pass
+
+    def close(self) -> None:
+        """Releases the resources held by the transport"""
+        pass
+
+
+class AsyncTransport(ABC):
+    """The base class for transports used by :class:`QrzAsync`"""
+    @abstractmethod
+    async def get(self, url: str) -> TransportResponse:
+        """Sends a GET request.
+
+        :param url: the URL to request
+        :type url: str
+        :return: the response
+        :rtype: TransportResponse
+        """
+        pass
+
+    async def start(self) -> None:
+        """Prepares the transport for use. Transports should also start themselves when first used."""
+        pass
+
+    async def close(self) -> None:
+        """Releases the resources held by the transport"""
+        pass
+
+
+# query parameters holding credentials, and the session key element of replies
+_SECRET_PARAMS = {"username", "password", "s"}
+_SESSION_KEY = re.compile(rb"<Key>[^<]*</Key>")
+_SCRUBBED = "scrubbed"
+
+
+def _scrub_url(url: str) -> str:
+    base, sep, query = url.partition("?")
+    params = [param.partition("=") for param in query.split(";")]
+    return base + sep + ";".join(k + eq + (_SCRUBBED if eq and k in _SECRET_PARAMS else v) for k, eq, v in params)
+
+
+def _scrub_body(body: bytes) -> bytes:
+    return _SESSION_KEY.sub(f"<Key>{_SCRUBBED}</Key>".encode(), body)
+
+
+class Recording:
+    """A set of recorded responses, keyed on the request URL, and how long each took. Used by the recording and
+    replay transports.
+
+    Unless ``scrub`` is ``False``, credentials and session keys are replaced with a placeholder before they are
+    recorded, so recordings can be shared and checked in. A client replaying a scrubbed recording logs in with the
+    placeholder key, and its queries are matched with the credentials and key left out, so any username and
+    password work.
+
+    Recordings are saved as JSON. If the file name ends in ``.gz``, they are saved compactly and compressed with
+    gzip.
+
+    .. warning::
+        A recording made with ``scrub=False`` holds the username, password and session key in plain text, and so
+        does any file it is saved to. Don't share it or check it in.
+
+    :param path: a file to load the recording from, if it exists
+    :type path: Optional[Union[str, Path]]
+    :param scrub: whether to remove credentials and session keys from recorded queries and responses
+    :type scrub: bool
+    """
+    def __init__(self, path: Optional[Union[str, Path]] = None, scrub: bool = True):
+        self._responses: Dict[str, TransportResponse] = {}
+        self._latencies: Dict[str, float] = {}
+        self._scrub = scrub
+        self._lock = threading.Lock()
+        if path is not None and Path(path).exists():
+            self.load(path)
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    def add(self, url: str, resp: TransportResponse, latency: float = 0.0) -> None:
+        """Records a response.
+
+        :param url: the request URL
+        :type url: str
+        :param resp: the response
+        :type resp: TransportResponse
+        :param latency: the number of seconds the request took
+        :type latency: float
+        """
+        if self._scrub:
+            url = _scrub_url(url)
+            resp = TransportResponse(resp.status, _scrub_body(resp.body), resp.encoding)
+        with self._lock:
+            self._responses[url] = resp
+            self._latencies[url] = latency
+
+    def get(self, url: str) -> TransportResponse:
+        """Gets the recorded response for a URL.
+
+        :param url: the request URL
+        :type url: str
+        :return: the response
+        :rtype: TransportResponse
+        :raises QrzError: if no response was recorded for the URL
+        """
+        with self._lock:
+            return self._responses[self._key(url)]
+
+    def latency(self, url: str) -> float:
+        """Gets the number of seconds the recorded request for a URL took.
+
+        :param url: the request URL
+        :type url: str
+        :return: the latency, ``0`` if it wasn't recorded
+        :rtype: float
+        :raises QrzError: if no response was recorded for the URL
+        """
+        with self._lock:
+            return self._latencies.get(self._key(url), 0.0)
+
+    def urls(self) -> List[str]:
+        """Gets the URLs responses were recorded for.
+
+        :return: the URLs, in the order they were first recorded
+        :rtype: List[str]
+        """
+        with self._lock:
+            return list(self._responses)
+
+    def load(self, path: Union[str, Path]) -> None:
+        """Loads recorded responses from a file, adding to the ones already recorded.
+
+        :param path: the file to load
+        :type path: Union[str, Path]
+        """
+        with (gzip.open(path, "rt", encoding="utf-8") if str(path).endswith(".gz") else open(path)) as f:
+            data = json.load(f)
+        with self._lock:
+            for url, resp in data.items():
+                body = resp["text"].encode("utf-8") if "text" in resp else base64.b64decode(resp["body"])
+                self._responses[url] = TransportResponse(resp["status"], body, resp["encoding"])
+                self._latencies[url] = resp.get("latency", 0.0)
+
+    def save(self, path: Union[str, Path]) -> None:
+        """Saves the recorded responses to a file. Unless the recording scrubs them, credentials and session keys are
+        written in plain text.
+
+        :param path: the file to save to
+        :type path: Union[str, Path]
+        """
+        with self._lock:
+            data = {url: {"status": resp.status, **self._encode_body(resp.body), "encoding": resp.encoding,
+                          "latency": round(self._latencies.get(url, 0.0), 6)}
+                    for url, resp in self._responses.items()}
+        if str(path).endswith(".gz"):
+            with gzip.open(path, "wt", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+        else:
+            with open(path, "w") as f:
+                json.dump(data, f, indent=1)
+
+    def _key(self, url: str) -> str:
+        # recordings made before scrubbing, or without it, are keyed on the URL as sent. Called with the lock held.
+        if url in self._responses:
+            return url
+        scrubbed = _scrub_url(url)
+        if scrubbed in self._responses:
+            return scrubbed
+        raise QrzError(f"No recorded response for {url}")
+
+    @staticmethod
+    def _encode_body(body: bytes) -> Dict[str, str]:
+        # replies are stored as text where possible, since base64 makes them larger and compresses worse
+        try:
+            return {"text": body.decode("utf-8")}
+        except UnicodeDecodeError:
+            return {"body": base64.b64encode(body).decode()}
+
+
+class RecordingTransport(Transport):
+    """A transport that passes requests to another transport and records the responses, and how long they took.
+    To record the queries of a client, wrap its transport:
+
+    .. code-block:: python
+
+        recording = Recording()
+        qrz = QrzSync("user", "pass")
+        qrz.transport = RecordingTransport(qrz.transport, recording)
+        qrz.get_callsign("W1AW")
+        recording.save("qrz.json.gz")
+
+    .. warning::
+        Everything sent through the transport is recorded, including the login query. Use a :class:`Recording`
+        that scrubs credentials (the default) unless the recording is kept private.
+
+    :param transport: the transport to send requests with
+    :type transport: Transport
+    :param recording: the recording to add responses to
+    :type recording: Recording
+    """
+    def __init__(self, transport: Transport, recording: Recording):
+        self._transport = transport
+        self._recording = recording
+
+    def get(self, url: str, timeout: Optional[float] = None) -> TransportResponse:
+        start = time.monotonic()
+        resp = self._transport.get(url, timeout)
+        self._recording.add(url, resp, time.monotonic() - start)
+        return resp
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class AsyncRecordingTransport(AsyncTransport):
+    """An async transport that passes requests to another transport and records the responses, and how long they
+    took. See :class:`RecordingTransport`.
+
+    :param transport: the transport to send requests with
+    :type transport: AsyncTransport
+    :param recording: the recording to add responses to
+    :type recording: Recording
+    """
+    def __init__(self, transport: AsyncTransport, recording: Recording):
+        self._transport = transport
+        self._recording = recording
+
+    async def get(self, url: str) -> TransportResponse:
+        start = time.monotonic()
+        resp = await self._transport.get(url)
+        self._recording.add(url, resp, time.monotonic() - start)
+        return resp
+
+    async def start(self) -> None:
+        await self._transport.start()
+
+    async def close(self) -> None:
+        await self._transport.close()
+
+
+class ReplayTransport(Transport):
+    """A transport that serves recorded responses, without any network access.
+
+    :param recording: the recording to serve responses from
+    :type recording: Recording
+    :param latency: how long to take to reply, as a multiple of the recorded latency. ``0`` replies at once, and
+        ``1`` replies as slowly as the recorded request
+    :type latency: float
+    """
+    def __init__(self, recording: Recording, latency: float = 0.0):
+        self._recording = recording
+        self._latency = latency
+
+    def get(self, url: str, timeout: Optional[float] = None) -> TransportResponse:
+        resp = self._recording.get(url)
+        delay = self._recording.latency(url) * self._latency
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise QrzTimeoutError("Query timed out")
+        if delay > 0:
+            time.sleep(delay)
+        return resp
+
+
+class AsyncReplayTransport(AsyncTransport):
+    """An async transport that serves recorded responses, without any network access.
+
+    :param recording: the recording to serve responses from
+    :type recording: Recording
+    :param latency: how long to take to reply, as a multiple of the recorded latency. ``0`` replies at once, and
+        ``1`` replies as slowly as the recorded request
+    :type latency: float
+    """
+    def __init__(self, recording: Recording, latency: float = 0.0):
+        self._recording = recording
+        self._latency = latency
+
+    async def get(self, url: str) -> TransportResponse:
+        resp = self._recording.get(url)
+        delay = self._recording.latency(url) * self._latency
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return resp
@@ -0,0 +1,391 @@
+"""
+qrztools: callsign watchlists
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+"""
+
+
+import asyncio
+import heapq
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields as dataclass_fields
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, TYPE_CHECKING
+
+from .qrztools import QrzCallsignData
+from .callsign import parse_callsign
+from .scheduler import Priority
+
+if TYPE_CHECKING:
+    from .qrzsync import QrzSync
+    from .qrzasync import QrzAsync
+
+
+#: fields that change without the record being edited, and are not watched by default
+UNWATCHED = frozenset({"profile_views", "serial", "last_modified", "bio", "stale"})
+
+
+@dataclass
+class FieldChange:
+    """A change to one field of a callsign record"""
+    #: the name of the field. Fields of nested data are joined with a dot, e.g. ``address.line1``
+    field: str
+    #: the old value
+    old: Any
+    #: the new value
+    new: Any
+
+
+@dataclass
+class RecordChange:
+    """A change to the record of a watched callsign"""
+    #: the callsign
+    callsign: str
+    #: the record before the change
+    old: QrzCallsignData
+    #: the record after the change
+    new: QrzCallsignData
+    #: the fields that changed
+    changes: List[FieldChange] = field(default_factory=list)
+
+
+def diff_records(old: QrzCallsignData, new: QrzCallsignData,
+                 fields: Optional[Iterable[str]] = None) -> List[FieldChange]:
+    """Compares two records of a callsign field by field.
+
+    :param old: the old record
+    :type old: QrzCallsignData
+    :param new: the new record
+    :type new: QrzCallsignData
+    :param fields: the names of the fields to compare. Defaults to all fields not in :data:`UNWATCHED`
+    :type fields: Optional[Iterable[str]]
+    :return: the fields that changed
+    :rtype: List[FieldChange]
+    """
+    if fields is None:
+        fields = [f.name for f in dataclass_fields(QrzCallsignData) if f.name not in UNWATCHED]
+    # the serialized values are compared, since gridtools objects don't support comparison
+    old_data, new_data = old.to_dict(), new.to_dict()
+    changes: List[FieldChange] = []
+    for name in fields:
+        old_val, new_val = old_data[name], new_data[name]
+        if old_val == new_val:
+            continue
+        if isinstance(old_val, dict) and isinstance(new_val, dict):
+            changes.extend(FieldChange(f"{name}.{key}", old_val[key], new_val[key])
+                           for key in old_val if old_val[key] != new_val[key])
+        else:
+            changes.append(FieldChange(name, getattr(old, name), getattr(new, name)))
+    return changes
+
+
+class _WatchEntry:
+    __slots__ = ("record", "due", "history")
+
+    def __init__(self, record: Optional[QrzCallsignData], due: float) -> None:
+        self.record = record
+        self.due = due
+        # the distinct last modified dates seen, oldest first
+        self.history: "deque[datetime]" = deque(maxlen=8)
+
+
+class _WatchlistBase:
+    # the schedule and change detection shared by the sync and async watchlists
+    def __init__(self, min_interval: float, max_interval: float, factor: float, fields: Optional[Iterable[str]]):
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._factor = factor
+        self._fields = list(fields) if fields is not None else None
+        self._entries: Dict[str, _WatchEntry] = {}
+        # (due time, callsign), entries that were rescheduled or removed are skipped when popped
+        self._queue: List[Tuple[float, str]] = []
+        self._listeners: List[Callable[[RecordChange], None]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, callsign: str) -> bool:
+        return parse_callsign(callsign).base in self._entries
+
+    def add(self, callsign: str, record: Optional[QrzCallsignData] = None) -> None:
+        """Adds a callsign to the watchlist. Its first poll is spread randomly over the minimum interval, so adding
+        many callsigns at once doesn't cause a burst of queries.
+
+        :param callsign: the callsign
+        :type callsign: str
+        :param record: the current record of the callsign, if known. Otherwise, the first poll only stores the record
+        :type record: Optional[QrzCallsignData]
+        """
+        callsign = parse_callsign(callsign).base
+        with self._lock:
+            entry = _WatchEntry(record, time.monotonic() + random.uniform(0, self._min_interval))
+            if record is not None:
+                self._record_history(entry, record)
+            self._entries[callsign] = entry
+            heapq.heappush(self._queue, (entry.due, callsign))
+
+    def remove(self, callsign: str) -> None:
+        """Removes a callsign from the watchlist.
+
+        :param callsign: the callsign
+        :type callsign: str
+        """
+        with self._lock:
+            self._entries.pop(parse_callsign(callsign).base, None)
+
+    def add_listener(self, listener: Callable[[RecordChange], None]) -> None:
+        """Adds a function to be called with each change found.
+
+        :param listener: the function
+        :type listener: Callable[[RecordChange], None]
+        """
+        self._listeners.append(listener)
+
+    def next_poll(self) -> Optional[float]:
+        """Gets the number of seconds until the next callsign is due to be polled.
+
+        :return: the number of seconds, ``0`` if callsigns are due, or ``None`` if the watchlist is empty
+        :rtype: Optional[float]
+        """
+        with self._lock:
+            self._drop_stale()
+            if not self._queue:
+                return None
+            return max(self._queue[0][0] - time.monotonic(), 0)
+
+    def _take_due(self) -> List[str]:
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            self._drop_stale()
+            while self._queue and self._queue[0][0] <= now:
+                due.append(heapq.heappop(self._queue)[1])
+                self._drop_stale()
+        return due
+
+    def _drop_stale(self) -> None:
+        while self._queue:
+            due, callsign = self._queue[0]
+            entry = self._entries.get(callsign)
+            if entry is not None and entry.due == due:
+                return
+            heapq.heappop(self._queue)
+
+    def _update(self, callsign: str, record: Optional[QrzCallsignData]) -> Optional[RecordChange]:
+        # record is None if the lookup failed, and the callsign is polled again after the usual interval. Listeners
+        # are called by _notify once every due callsign is rescheduled, so one raising can't leave any unscheduled.
+        change = None
+        with self._lock:
+            entry = self._entries.get(callsign)
+            if entry is None:
+                return None
+            old = entry.record
+            if record is not None:
+                # serial and moddate change whenever the record is edited, so other fields are only compared then
+                if old is not None and (record.serial != old.serial or record.last_modified != old.last_modified):
+                    changes = diff_records(old, record, self._fields)
+                    if changes:
+                        change = RecordChange(callsign, old, record, changes)
+                entry.record = record
+                self._record_history(entry, record)
+            entry.due = time.monotonic() + self._interval(entry) * random.uniform(0.9, 1.1)
+            heapq.heappush(self._queue, (entry.due, callsign))
+        return change
+
+    def _requeue(self, callsign: str) -> None:
+        # puts back a callsign whose poll was interrupted, to be polled again right away
+        with self._lock:
+            entry = self._entries.get(callsign)
+            if entry is not None:
+                entry.due = time.monotonic()
+                heapq.heappush(self._queue, (entry.due, callsign))
+
+    def _notify(self, changes: List[Optional[RecordChange]]) -> List[RecordChange]:
+        found = [change for change in changes if change is not None]
+        for change in found:
+            for listener in self._listeners:
+                listener(change)
+        return found
+
+    def _record_history(self, entry: _WatchEntry, record: QrzCallsignData) -> None:
+        if record.last_modified != datetime.min and (not entry.history or entry.history[-1] != record.last_modified):
+            entry.history.append(record.last_modified)
+
+    def _interval(self, entry: _WatchEntry) -> float:
+        # records are polled at a fraction of the average time between their recent changes, counting the time since
+        # the last change, so records that are often edited are polled often and ones that never are back off
+        if not entry.history:
+            return self._max_interval
+        # QRZ sends modification dates without a timezone, and they are taken to be UTC. Were they off by a few hours,
+        # only the schedule of records edited within the last day or so would change, and within the interval bounds.
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        period = (now - entry.history[0]).total_seconds() / len(entry.history)
+        return min(max(period * self._factor, self._min_interval), self._max_interval)
+
+
+class Watchlist(_WatchlistBase):
+    """Watches callsigns for changes to their records, using a :class:`QrzSync` object.
+
+    Each callsign is polled on its own schedule, based on how often its record was modified in the past, between
+    ``min_interval`` and ``max_interval`` seconds. A poll compares the record's serial number and modification date
+    with the ones stored, and only if they moved are the fields compared. Changes are returned by :meth:`poll` and
+    passed to the listeners added with :meth:`add_listener`. A poll that fails, whatever the error, leaves the stored
+    record as it is, and the callsign is polled again after its usual interval.
+
+    Polls always query QRZ, bypassing the :attr:`QrzAbc.cache`, and go through the client's rate limiter and circuit
+    breaker. A :class:`RateLimiter` on the client is recommended, so a large watchlist is polled at an even pace.
+
+    :param qrz: the QRZ object to look up callsigns with
+    :type qrz: QrzSync
+    :param min_interval: the minimum number of seconds between polls of a callsign
+    :type min_interval: float
+    :param max_interval: the maximum number of seconds between polls of a callsign
+    :type max_interval: float
+    :param factor: the fraction of the average time between changes of a record to poll it at
+    :type factor: float
+    :param fields: the names of the fields to watch. Defaults to all fields not in :data:`UNWATCHED`
+    :type fields: Optional[Iterable[str]]
+    :param workers: the number of concurrent lookups
+    :type workers: int
+    """
+    def __init__(self, qrz: "QrzSync", min_interval: float = 3600, max_interval: float = 7 * 86400,
+                 factor: float = 0.25, fields: Optional[Iterable[str]] = None, workers: int = 8):
+        super().__init__(min_interval, max_interval, factor, fields)
+        self._qrz = qrz
+        self._workers = workers
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def poll(self) -> List[RecordChange]:
+        """Polls the callsigns that are due.
+
+        :return: the changes found
+        :rtype: List[RecordChange]
+        """
+        due = self._take_due()
+        if not due:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self._workers, len(due))) as executor:
+            records = list(executor.map(self._lookup, due))
+        return self._notify([self._update(callsign, record) for callsign, record in zip(due, records)])
+
+    def start(self, tick: float = 1) -> None:
+        """Starts a background thread that polls callsigns as they are due.
+
+        :param tick: the maximum number of seconds between checks for due callsigns
+        :type tick: float
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(tick,), daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the background thread started by :meth:`start`"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self, tick: float) -> None:
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception:
+                # a listener raised, but every polled callsign was rescheduled, so polling carries on
+                pass
+            wait = self.next_poll()
+            self._stop.wait(tick if wait is None else min(wait, tick))
+
+    def _lookup(self, callsign: str) -> Optional[QrzCallsignData]:
+        try:
+            return self._qrz._lookup_callsign(callsign, self._qrz._deadline(None))
+        except Exception:
+            # network and parsing errors count as a failed poll, like errors from QRZ
+            return None
+
+
+class AsyncWatchlist(_WatchlistBase):
+    """Like :class:`Watchlist`, but looks up callsigns with a :class:`QrzAsync` object. Polls are sent with
+    :attr:`Priority.LOW` if the client has a :class:`Scheduler`.
+
+    :param qrz: the QRZ object to look up callsigns with
+    :type qrz: QrzAsync
+    :param min_interval: the minimum number of seconds between polls of a callsign
+    :type min_interval: float
+    :param max_interval: the maximum number of seconds between polls of a callsign
+    :type max_interval: float
+    :param factor: the fraction of the average time between changes of a record to poll it at
+    :type factor: float
+    :param fields: the names of the fields to watch. Defaults to all fields not in :data:`UNWATCHED`
+    :type fields: Optional[Iterable[str]]
+    :param workers: the number of concurrent lookups
+    :type workers: int
+    """
+    def __init__(self, qrz: "QrzAsync", min_interval: float = 3600, max_interval: float = 7 * 86400,
+                 factor: float = 0.25, fields: Optional[Iterable[str]] = None, workers: int = 8):
+        super().__init__(min_interval, max_interval, factor, fields)
+        self._qrz = qrz
+        self._workers = workers
+        self._task: Optional[asyncio.Task] = None
+
+    async def poll(self) -> List[RecordChange]:
+        """Polls the callsigns that are due.
+
+        :return: the changes found
+        :rtype: List[RecordChange]
+        """
+        semaphore = asyncio.Semaphore(self._workers)
+
+        async def lookup(callsign: str) -> Optional[RecordChange]:
+            record: Optional[QrzCallsignData]
+            try:
+                async with semaphore:
+                    record = await self._qrz._run(self._qrz._lookup_callsign(callsign), None, Priority.LOW)
+            except asyncio.CancelledError:
+                self._requeue(callsign)
+                raise
+            except Exception:
+                # network and parsing errors count as a failed poll, like errors from QRZ
+                record = None
+            return self._update(callsign, record)
+
+        return self._notify(list(await asyncio.gather(*(lookup(callsign) for callsign in self._take_due()))))
+
+    def start(self, tick: float = 1) -> None:
+        """Starts a background task that polls callsigns as they are due.
+
+        :param tick: the maximum number of seconds between checks for due callsigns
+        :type tick: float
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(tick))
+
+    async def stop(self) -> None:
+        """Stops the background task started by :meth:`start`"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self, tick: float) -> None:
+        while True:
+            try:
+                await self.poll()
+            except Exception:
+                # a listener raised, but every polled callsign was rescheduled, so polling carries on
+                pass
+            wait = self.next_poll()
+            await asyncio.sleep(tick if wait is None else min(wait, tick))
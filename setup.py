@@ -42,6 +42,9 @@ setup(
     extras_require={
         "cli": ["rich"],
         "async": ["aiohttp"],
-        "all": ["aiohttp"]
+        "http2": ["httpx[http2]"],
+        "geo": ["numpy"],
+        "msgpack": ["msgpack"],
+        "all": ["aiohttp", "httpx[http2]", "numpy", "msgpack"]
     }
 )
@@ -0,0 +1,128 @@
+"""
+qrztools: circuit breaker tests
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+
+Run with ``python -m unittest discover tests``.
+"""
+
+
+import asyncio
+import unittest
+from typing import Optional
+
+import aiohttp
+
+from qrztools import (AsyncTransport, BreakerState, CircuitBreaker, QrzAsync, QrzSync, QrzTimeoutError, RateLimiter,
+                      Scheduler, Transport, TransportResponse)
+
+
+REPLY = (b'<?xml version="1.0" ?><QRZDatabase version="1.34" xmlns="http://xmldata.qrz.com">'
+         b"<Callsign><call>W1AW</call><geoloc>user</geoloc></Callsign><Session><Key>key</Key></Session></QRZDatabase>")
+
+
+class ReplyTransport(Transport):
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def get(self, url: str, timeout: Optional[float] = None) -> TransportResponse:
+        self.calls += 1
+        return TransportResponse(200, REPLY, "utf-8")
+
+
+class AsyncScriptedTransport(AsyncTransport):
+    # fails, hangs until cancelled, or replies, depending on mode
+    def __init__(self) -> None:
+        self.mode = "reply"
+
+    async def get(self, url: str) -> TransportResponse:
+        if self.mode == "fail":
+            raise aiohttp.ClientConnectionError("connection refused")
+        if self.mode == "hang":
+            await asyncio.sleep(3600)
+        if self.mode == "slow":
+            await asyncio.sleep(0.3)
+        return TransportResponse(200, REPLY, "utf-8")
+
+
+class TestBreaker(unittest.TestCase):
+    def test_rate_limit_wait_is_not_a_failure(self) -> None:
+        transport = ReplyTransport()
+        breaker = CircuitBreaker(failures=2)
+        qrz = QrzSync("user", "pass", session_key="key", transport=transport, breaker=breaker,
+                      rate_limiter=RateLimiter(1), timeout=0.2)
+        qrz.get_callsign("W1AW")
+        for _ in range(2):
+            with self.assertRaises(QrzTimeoutError):
+                qrz.get_callsign("W1AW")
+        self.assertEqual(transport.calls, 1)
+        self.assertIs(breaker.state, BreakerState.CLOSED)
+
+
+class TestAsyncBreaker(unittest.TestCase):
+    def test_scheduler_wait_is_not_a_failure(self) -> None:
+        async def run() -> None:
+            transport = AsyncScriptedTransport()
+            transport.mode = "slow"
+            breaker = CircuitBreaker(failures=2)
+            qrz = QrzAsync("user", "pass", session_key="key", transport=transport, breaker=breaker,
+                           scheduler=Scheduler(concurrency=1))
+            first = asyncio.ensure_future(qrz.get_callsign("W1AW"))
+            await asyncio.sleep(0.01)
+            # these time out while queued behind the first query
+            for _ in range(2):
+                with self.assertRaises(QrzTimeoutError):
+                    await qrz.get_callsign("W1AW", timeout=0.05)
+            self.assertEqual((await first).call, "W1AW")
+            self.assertIs(breaker.state, BreakerState.CLOSED)
+
+        asyncio.run(run())
+
+    def test_cancelled_probe_is_given_back(self) -> None:
+        async def run() -> None:
+            transport = AsyncScriptedTransport()
+            breaker = CircuitBreaker(failures=1, reset_timeout=0.05)
+            qrz = QrzAsync("user", "pass", session_key="key", transport=transport, breaker=breaker)
+
+            transport.mode = "fail"
+            with self.assertRaises(aiohttp.ClientConnectionError):
+                await qrz.get_callsign("W1AW")
+            self.assertIs(breaker.state, BreakerState.OPEN)
+
+            # the probe sent once the breaker is half-open is cancelled by the caller, not by a timeout
+            await asyncio.sleep(0.1)
+            transport.mode = "hang"
+            task = asyncio.ensure_future(qrz.get_callsign("W1AW"))
+            await asyncio.sleep(0.01)
+            self.assertIs(breaker.state, BreakerState.HALF_OPEN)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+            transport.mode = "reply"
+            self.assertEqual((await qrz.get_callsign("W1AW")).call, "W1AW")
+            self.assertIs(breaker.state, BreakerState.CLOSED)
+
+        asyncio.run(run())
+
+    def test_timed_out_probe_reopens(self) -> None:
+        async def run() -> None:
+            transport = AsyncScriptedTransport()
+            breaker = CircuitBreaker(failures=1, reset_timeout=0.05)
+            qrz = QrzAsync("user", "pass", session_key="key", transport=transport, breaker=breaker)
+
+            transport.mode = "fail"
+            with self.assertRaises(aiohttp.ClientConnectionError):
+                await qrz.get_callsign("W1AW")
+            await asyncio.sleep(0.1)
+            transport.mode = "hang"
+            with self.assertRaises(Exception):
+                await qrz.get_callsign("W1AW", timeout=0.05)
+            self.assertIs(breaker.state, BreakerState.OPEN)
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
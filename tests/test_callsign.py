@@ -0,0 +1,38 @@
+"""
+qrztools: callsign parsing tests
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+
+Run with ``python -m unittest discover tests``.
+"""
+
+
+import unittest
+
+from qrztools import ParsedCallsign, parse_callsign
+
+
+class TestParseCallsign(unittest.TestCase):
+    def test_designators(self) -> None:
+        cases = {
+            "W1AW": ParsedCallsign("W1AW"),
+            "W1AW/P": ParsedCallsign("W1AW", suffix="P"),
+            "W1AW/4": ParsedCallsign("W1AW", suffix="4"),
+            "VE3/K1ABC": ParsedCallsign("K1ABC", prefix="VE3"),
+            "K1ABC/VE3": ParsedCallsign("K1ABC", suffix="VE3"),
+            "VE3/K1ABC/P": ParsedCallsign("K1ABC", prefix="VE3", suffix="P"),
+        }
+        for callsign, parsed in cases.items():
+            with self.subTest(callsign=callsign):
+                self.assertEqual(parse_callsign(callsign), parsed)
+
+    def test_same_length_parts(self) -> None:
+        # the part that looks like a callsign is the base, and otherwise PREFIX/CALL is assumed
+        self.assertEqual(parse_callsign("3D2/K1A"), ParsedCallsign("K1A", prefix="3D2"))
+        self.assertEqual(parse_callsign("VP2E/N1AB"), ParsedCallsign("N1AB", prefix="VP2E"))
+        self.assertEqual(parse_callsign("W1AW/KH6"), ParsedCallsign("W1AW", suffix="KH6"))
+
+
+if __name__ == "__main__":
+    unittest.main()
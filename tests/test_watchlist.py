@@ -0,0 +1,105 @@
+"""
+qrztools: watchlist tests
+---
+Copyright 2021 classabbyamp, 0x5c
+Released under the terms of the BSD 3-Clause license.
+
+Run with ``python -m unittest discover tests``.
+"""
+
+
+import asyncio
+import time
+import unittest
+from typing import Optional
+
+import aiohttp
+import requests
+
+from qrztools import AsyncTransport, AsyncWatchlist, QrzAsync, QrzSync, Transport, TransportResponse, Watchlist
+
+
+class FailingTransport(Transport):
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def get(self, url: str, timeout: Optional[float] = None) -> TransportResponse:
+        self.calls += 1
+        raise requests.ConnectionError("connection refused")
+
+
+class AsyncFailingTransport(AsyncTransport):
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def get(self, url: str) -> TransportResponse:
+        self.calls += 1
+        raise aiohttp.ClientConnectionError("connection refused")
+
+
+class TestWatchlist(unittest.TestCase):
+    def test_transport_error_reschedules(self) -> None:
+        transport = FailingTransport()
+        qrz = QrzSync("user", "pass", session_key="key", transport=transport)
+        watchlist = Watchlist(qrz, min_interval=0, max_interval=60)
+        watchlist.add("W1AW")
+        watchlist.add("K1ABC")
+
+        self.assertEqual(watchlist.poll(), [])
+        self.assertEqual(transport.calls, 2)
+        # both callsigns are still scheduled, for after the usual interval
+        self.assertEqual(len(watchlist._queue), 2)
+        next_poll = watchlist.next_poll()
+        self.assertIsNotNone(next_poll)
+        self.assertGreater(next_poll, 0)
+
+    def test_thread_survives_errors(self) -> None:
+        transport = FailingTransport()
+        qrz = QrzSync("user", "pass", session_key="key", transport=transport)
+        watchlist = Watchlist(qrz, min_interval=0, max_interval=0)
+        watchlist.add("W1AW")
+        watchlist.start(tick=0.01)
+        try:
+            time.sleep(0.2)
+            self.assertTrue(watchlist._thread is not None and watchlist._thread.is_alive())
+        finally:
+            watchlist.stop()
+        # polled over and over, not only once
+        self.assertGreater(transport.calls, 1)
+
+
+class TestAsyncWatchlist(unittest.TestCase):
+    def test_transport_error_reschedules(self) -> None:
+        async def run() -> None:
+            transport = AsyncFailingTransport()
+            qrz = QrzAsync("user", "pass", session_key="key", transport=transport)
+            watchlist = AsyncWatchlist(qrz, min_interval=0, max_interval=60)
+            watchlist.add("W1AW")
+            watchlist.add("K1ABC")
+
+            self.assertEqual(await watchlist.poll(), [])
+            self.assertEqual(transport.calls, 2)
+            self.assertEqual(len(watchlist._queue), 2)
+            next_poll = watchlist.next_poll()
+            self.assertIsNotNone(next_poll)
+            self.assertGreater(next_poll, 0)
+
+        asyncio.run(run())
+
+    def test_task_survives_errors(self) -> None:
+        async def run() -> None:
+            transport = AsyncFailingTransport()
+            qrz = QrzAsync("user", "pass", session_key="key", transport=transport)
+            watchlist = AsyncWatchlist(qrz, min_interval=0, max_interval=0)
+            watchlist.add("W1AW")
+            watchlist.start(tick=0.01)
+            await asyncio.sleep(0.2)
+            self.assertTrue(watchlist._task is not None and not watchlist._task.done())
+            await watchlist.stop()
+            self.assertGreater(transport.calls, 1)
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()